@@ -0,0 +1,233 @@
+"""
+Benchmark suite for the main operations of the library
+
+Times Genome operations over a sweep of genome sizes and Population operations over
+a sweep of population sizes. Results are written as JSON and can be compared
+against a previously saved run to catch regressions.
+
+Usage:
+python benchmark.py --output results.json
+python benchmark.py --output results.json --baseline baseline.json --tolerance 0.2
+"""
+from settings import GenomeSettings, PopulationSettings, EvaluationSettings, ReproductionSettings
+from innovationManager import InnovationManager
+from population import Population
+from genome import Genome
+from brain import Brain
+import numpy as np
+import contextlib
+import argparse
+import platform
+import random
+import json
+import time
+import io
+import os
+
+class BenchmarkBrain(Brain):
+    """
+    Brain fitting a fixed random dataset, evaluated with a single batched pass
+    """
+    batchInputValues = None
+    expected = None
+
+    def fitnessEvaluation(self):
+        return self.fitnessEvaluationBatch(self.generateOutputValuesBatch(self.batchInputValues))
+
+    def fitnessEvaluationBatch(self, outputValues):
+        return 1 / (1 + np.abs(outputValues - self.expected).mean())
+
+def timeit(function, repeat):
+    """
+    Returns the mean time of a call to param function, in seconds
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+def makeGenome(manager, settings, size):
+    """
+    Creates a genome grown by param size node and connection mutations
+    """
+    genome = Genome(manager, settings)
+    for _ in range(size):
+        genome.mutateAddNode()
+        genome.mutateAddConnection()
+    return genome
+
+def forwardNodes(genome, network, inputValues):
+    """
+    Reference forward pass calling Node.forward on every node of param network, the
+    nodes of param genome sorted by (layer, id), as genomes were run before compilation
+    """
+    inputs = inputValues + [1]*genome.settings.bias
+    for i, node in enumerate(network):
+        node.value = inputs[i] if i < len(inputs) else 0
+    for node in network:
+        node.forward()
+    return [n.value for n in network[-genome.settings.outputs:]]
+
+def benchmarkGenomes(genomeSizes, repeat, inputs, outputs, batch=100):
+    """
+    The *Reference entries time the per-node and per-connection code paths the
+    compiled and batched ones replace. mutateWeightsBatch is the time per genome
+    when param batch genomes are mutated at once, as Population.reproduce does.
+    """
+    results = []
+    settings = GenomeSettings(inputs=inputs, outputs=outputs, bias=1)
+    inputValues = [random.random() for _ in range(inputs)]
+
+    for size in genomeSizes:
+        manager = InnovationManager(settings)
+        a = makeGenome(manager, settings, size)
+        b = makeGenome(manager, settings, size)
+
+        def evaluate():
+            # new weights every call so that the compilation is measured too
+            a.invalidate()
+            a.generateOutputValues(inputValues)
+
+        network = sorted(a.nodes.values(), key=lambda n: (n.layer, n.id))
+        # mutations are timed on copies made beforehand, a stays the same
+        mutated = iter([a.clone() for _ in range(repeat)])
+        copies = [a.clone() for _ in range(batch)]
+        weightBatch = [(g, [c for c in g.connections.values() if c.enabled]) for g in copies]
+        generator = np.random.default_rng(0)
+
+        timings = {
+            "clone": (lambda: a.clone(), 1),
+            "mutate": (lambda: next(mutated).mutate(), 1),
+            "mutateWeightReference": (lambda: copies[0].mutateWeight(), 1),
+            "mutateWeightsBatch": (lambda: Genome.mutateWeights(weightBatch, settings.mutation, generator), batch),
+            "crossover": (lambda: Genome.crossover(a, b), 1),
+            "distance": (lambda: (a.invalidate(), b.invalidate(), a.distance(b)), 1),
+            "generateOutputValues": (evaluate, 1),
+            "generateOutputValuesCached": (lambda: a.generateOutputValues(inputValues), 1),
+            "generateOutputValuesReference": (lambda: forwardNodes(a, network, inputValues), 1),
+        }
+        for name, (function, genomes) in timings.items():
+            results.append({
+                "benchmark": f"genome.{name}",
+                "genomeSize": size,
+                "nodes": len(a.nodes),
+                "connections": len(a.connections),
+                "seconds": timeit(function, repeat) / genomes,
+            })
+    return results
+
+def benchmarkPopulations(populationSizes, generations, inputs, outputs, samples):
+    """
+    reproduceMainProcess is the part of reproduce done in this process, with a parallel
+    reproduction the rest runs on the other cores
+    """
+    results = []
+    settings = GenomeSettings(inputs=inputs, outputs=outputs, bias=1)
+    BenchmarkBrain.batchInputValues = np.random.default_rng(0).random((samples, inputs))
+    BenchmarkBrain.expected = np.random.default_rng(1).random((samples, outputs))
+
+    for size in populationSizes:
+        # (evaluation, reproduction) modes, the offspring of a parallel reproduction are only
+        # rebuilt in this process when they are evaluated in it
+        for mode, reproduction in (("serial", "serial"), ("vectorized", "serial"), ("parallel", "serial"), ("parallel", "parallel")):
+            populationSettings = PopulationSettings(size, settings, evaluationSettings=EvaluationSettings(mode),
+                                                    reproductionSettings=ReproductionSettings(reproduction))
+            with Population(populationSettings, BenchmarkBrain) as population:
+                # wall time of every reproduction and the CPU time this process spends on it,
+                # the work done by the worker processes only counts in the former
+                reproduce = population.reproduce
+                wall, cpu = [], []
+                def timedReproduce(tasks):
+                    start, startCpu = time.perf_counter(), time.process_time()
+                    offspring = reproduce(tasks)
+                    wall.append(time.perf_counter() - start)
+                    cpu.append(time.process_time() - startCpu)
+                    return offspring
+                population.reproduce = timedReproduce
+
+                # evolve prints its progress
+                with contextlib.redirect_stdout(io.StringIO()):
+                    evolve = timeit(population.evolve, generations)
+                    speciate = timeit(population.speciate, 1)
+                    evaluate = timeit(population.evaluateFitness, 1)
+
+            for name, seconds in (("evolve", evolve), ("speciate", speciate), ("evaluateFitness", evaluate),
+                                  ("reproduce", sum(wall) / len(wall)), ("reproduceMainProcess", sum(cpu) / len(cpu))):
+                results.append({
+                    "benchmark": f"population.{name}",
+                    "populationSize": size,
+                    "mode": mode,
+                    "reproduction": reproduction,
+                    "seconds": seconds,
+                })
+    return results
+
+def key(result):
+    return tuple((k, v) for k, v in sorted(result.items()) if k not in ("seconds", "nodes", "connections"))
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the comparison of param results against param baseline
+
+    returns the list of benchmarks slower than the baseline by more than param tolerance
+    """
+    reference = {key(r): r["seconds"] for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        base = reference.get(key(r))
+        if base is None:
+            continue
+        ratio = r["seconds"] / base if base > 0 else float("inf")
+        print(f"{r['benchmark']:40} {dict(key(r)[1:])} {base*1000:10.3f}ms -> {r['seconds']*1000:10.3f}ms ({ratio:.2f}x)")
+        if ratio > 1 + tolerance:
+            regressions.append(r)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="neat-py benchmark suite")
+    parser.add_argument("--output", default="benchmark.json", help="where to write the results")
+    parser.add_argument("--baseline", default=None, help="results of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before reporting a regression")
+    parser.add_argument("--genome-sizes", type=int, nargs="+", default=[0, 10, 50, 100])
+    parser.add_argument("--population-sizes", type=int, nargs="+", default=[150, 1000])
+    parser.add_argument("--repeat", type=int, default=100, help="calls per genome benchmark")
+    parser.add_argument("--generations", type=int, default=5, help="generations per population benchmark")
+    parser.add_argument("--inputs", type=int, default=10)
+    parser.add_argument("--outputs", type=int, default=2)
+    parser.add_argument("--samples", type=int, default=32, help="dataset size of the population benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    results = benchmarkGenomes(args.genome_sizes, args.repeat, args.inputs, args.outputs)
+    results += benchmarkPopulations(args.population_sizes, args.generations, args.inputs, args.outputs, args.samples)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "arguments": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if len(regressions) > 0:
+            print(f"{len(regressions)} regression(s) above {args.tolerance:.0%}")
+            return 1
+    else:
+        for r in results:
+            print(f"{r['benchmark']:40} {dict(key(r)[1:])} {r['seconds']*1000:10.3f}ms")
+
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
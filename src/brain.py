@@ -1,8 +1,10 @@
 from genome import Genome
+from compactGenome import CompactGenome
+import random
 from settings import GenomeSettings
 from innovationManager import InnovationManager
+from phenotype import NetworkState
 from utils import sigmoid
-from matplotlib import pyplot as plt
 
 class Brain:
     """
@@ -15,17 +17,68 @@ class Brain:
     >def fitnessEvaluationMethod(self):
     This method should compute and return the fitness of the brain
 
+    For vectorized evaluation, set the batchInputValues class attribute and override:
+    >def fitnessEvaluationBatch(self, outputValues):
+    This method should compute and return the fitness of the brain from its outputs
+
     """
+    # input samples shared by every brain, used by the "vectorized" evaluation mode
+    batchInputValues = None
+
     def __init__(self, genome, generation=0):
-        self.genome: Genome = genome
+        self._genome: Genome = genome
+        # (CompactGenome, manager, settings) of a brain whose genome isn't rebuilt yet, see fromCompact()
+        self.pending = None
         self.generation = generation
         self.fitness = 0.0
 
         self.inputValues = []
         self.outputValues = []
+
+        # buffers of the stateful step mode, see generateOutputValuesStep()
+        self.state: NetworkState = None
     
     def __str__(self):
-        return f"Brain - Fitness: {self.fitness} - Generation: {self.generation} - Neurons: {len(self.genome.nodes) + len(self.genome.connections)}"
+        return f"Brain - Fitness: {self.fitness} - Generation: {self.generation} - Neurons: {self.genomeSize()}"
+
+    @property
+    def genome(self) -> Genome:
+        """
+        Genome of the brain, rebuilt from its CompactGenome on first access for brains made by fromCompact()
+        """
+        if self._genome is None:
+            compact, manager, settings = self.pending
+            self._genome = compact.toGenome(manager, settings)
+            self._genome.compact = compact
+            self.pending = None
+        return self._genome
+
+    @genome.setter
+    def genome(self, genome: Genome):
+        self._genome = genome
+        self.pending = None
+
+    def toCompact(self) -> CompactGenome:
+        """
+        Returns the CompactGenome of the brain, it is shared and must not be modified
+        """
+        if self._genome is None:
+            return self.pending[0]
+        if self._genome.compact is None:
+            self._genome.compact = CompactGenome.fromGenome(self._genome)
+        return self._genome.compact
+
+    def genes(self):
+        """
+        Returns the genes read by the distance and fitness cache computations,
+        the genome itself or its CompactGenome if it isn't rebuilt yet
+        """
+        return self._genome if self._genome is not None else self.pending[0]
+
+    def genomeSize(self):
+        if self._genome is None:
+            return len(self.pending[0].nodeIds) + len(self.pending[0].innovations)
+        return len(self._genome.nodes) + len(self._genome.connections)
 
     @classmethod
     def create(cls, manager: InnovationManager, settings: GenomeSettings):
@@ -33,13 +86,42 @@ class Brain:
         return cls(genome)
 
     @classmethod
-    def crossover(cls, first, second):
-        genome = Genome.crossover(first.genome, second.genome, sameFitness=first.fitness==second.fitness)
+    def fromCompact(cls, genome: CompactGenome, manager: InnovationManager, settings: GenomeSettings, generation=0):
+        """
+        Returns a brain whose Genome is only rebuilt from param genome when it is needed,
+        e.g. offspring made by worker processes that may never be mutated in this process
+        """
+        brain = cls(None, generation=generation)
+        brain.pending = (genome, manager, settings)
+        return brain
+
+    @classmethod
+    def crossover(cls, first, second, rng=random):
+        genome = Genome.crossover(first.genome, second.genome, sameFitness=first.fitness==second.fitness, rng=rng)
         return cls(genome)
     
+    @classmethod
+    def offspring(cls, first, second=None, rng=random, weightBatch: list = None):
+        """
+        Returns a mutated clone of param first if param second is None,
+        else the crossover child of first and second (first being the fittest)
+
+        weightBatch: see Genome.mutate()
+        """
+        if second is None:
+            child = cls.clone(first)
+            child.mutate(rng, weightBatch)
+            return child
+        return cls.crossover(first, second, rng)
+
     @classmethod
     def clone(cls, brain):
-        copy = cls(brain.genome.clone(), generation=brain.generation)
+        if brain.pending is not None:
+            # counted like the genome clone it stands for
+            Genome.clones += 1
+            copy = cls.fromCompact(*brain.pending, generation=brain.generation)
+        else:
+            copy = cls(brain.genome.clone(), generation=brain.generation)
         copy.fitness = brain.fitness
         return copy
 
@@ -48,6 +130,14 @@ class Brain:
         genome = Genome.fromFile(fileName, manager, settings)
         return cls(genome)
 
+    @classmethod
+    def fromBinaryFile(cls, fileName: str, manager: InnovationManager, settings: GenomeSettings):
+        genome = CompactGenome.load(fileName).toGenome(manager, settings)
+        return cls(genome)
+
+    def saveBinary(self, fileName: str):
+        self.toCompact().save(fileName)
+
     def setInputValues(self):
         """
         Method to overload to get inputs to feed to the neural network
@@ -72,23 +162,79 @@ class Brain:
         self.setInputValues()
         self.generateOutputValues()
         return 1 / distanceWithExpectedOutputs(self.outputValues)
+
+        Typical implementation for a fixed dataset:
+        outputs = self.generateOutputValuesBatch(samples)
+        return 1 / distanceWithExpectedOutputs(outputs)
+        """
+
+        raise NotImplementedError
+
+    def fitnessEvaluationBatch(self, outputValues):
         """
+        Method to overload to use the "vectorized" evaluation mode
+        This method returns a float fitness value
 
+        outputValues: ndarray of shape [N, outputs], the outputs of this brain
+        for every sample of batchInputValues
+        """
         raise NotImplementedError
 
+    async def fitnessEvaluationAsync(self):
+        """
+        Method to overload to evaluate brains concurrently with Population.evolveAsync,
+        typically when the fitness comes from another process or over the network
+        This coroutine returns a float fitness value
+
+        defaults to calling fitnessEvaluation()
+        """
+        return self.fitnessEvaluation()
+
     def generateOutputValues(self):
         self.outputValues = self.genome.generateOutputValues(self.inputValues)
 
+    def generateOutputValuesStep(self):
+        """
+        Stateful version of generateOutputValues() for game loops, to call once per frame
+
+        Node values are kept from one call to the next and feed the recurrent connections,
+        call resetState() when a new episode starts. The buffers are built once and reused,
+        self.inputValues is best given as a list. self.outputValues is a list overwritten
+        by the next call.
+        """
+        if self.state is None or self.state.phenotype is not self.genome.compile():
+            self.state = self.genome.createState()
+        self.outputValues = self.state.step(self.inputValues)
+        return self.outputValues
+
+    def resetState(self):
+        if self.state is not None:
+            self.state.reset()
+
+    def generateOutputValuesBatch(self, inputValues):
+        """
+        Evaluates every row of inputValues (ndarray of shape [N, inputs]) in one pass
+
+        returns an ndarray of shape [N, outputs], also stored in self.outputValues
+        """
+        self.outputValues = self.genome.generateOutputValuesBatch(inputValues)
+        return self.outputValues
+
     def evaluateFitness(self):
         self.fitness = self.fitnessEvaluation()
 
-    def mutate(self):
-        self.genome.mutate()
+    async def evaluateFitnessAsync(self):
+        self.fitness = await self.fitnessEvaluationAsync()
+
+    def mutate(self, rng=random, weightBatch: list = None):
+        self.genome.mutate(rng, weightBatch)
 
     def distance(self, brain):
         return self.genome.distance(brain.genome)
 
     def plot(self, block=False, pauseTime=1.0, fname=None):
+        from matplotlib import pyplot as plt
+
         plt.clf()
         plt.title(f"Fitness: {self.fitness}")
         self.genome.plot(block, pauseTime, fname)
\ No newline at end of file
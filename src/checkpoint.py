@@ -0,0 +1,128 @@
+"""
+Binary checkpoints of a whole Population
+
+A checkpoint is a single uncompressed .npz file, written under the exact file name
+it is given. Every brain referenced by the
+population (current brains, species members and champions) is stored once as packed
+genome arrays, the rest of the state refers to brains by index. The hall of fame
+entries are packed separately, they are not brains.
+np.load only reads an array from the file when it is accessed.
+
+The population's random streams and the state of the random module are saved too
+so that a resumed run makes the same random choices as an uninterrupted one.
+
+A checkpoint is written to a temporary file next to the target and then moved onto
+it: an interrupted save leaves the previous checkpoint intact.
+"""
+from compactGenome import packGenomes, unpackGenomes
+from hallOfFame import HallOfFameEntry
+from innovationManager import InnovationManager, ConnectionInnovation, NodeInnovation
+from population import Population
+from species import Species
+import numpy as np
+import pickle
+import random
+import os
+
+def saveCheckpoint(population: Population, fileName):
+    brains = []
+    indices = {}
+    def index(brain):
+        # every brain is stored once even if it is referenced several times
+        if id(brain) not in indices:
+            indices[id(brain)] = len(brains)
+            brains.append(brain)
+        return indices[id(brain)]
+
+    brainIndices = [index(b) for b in population.brains]
+    speciesMembers = [[index(b) for b in s.population] for s in population.species]
+    speciesChampions = [index(s.champion) for s in population.species]
+    globalChampion = index(population.globalChampion)
+
+    manager = population.innovationManager
+    connectionInnovations = list(manager.connectionInnovationHistory.values())
+    recurrentInnovations = list(manager.recurrentInnovationHistory.values())
+    nodeInnovations = list(manager.nodeInnovationHistory.values())
+
+    arrays = {f"genome.{name}": a for name, a in packGenomes([b.toCompact() for b in brains]).items()}
+    arrays.update({f"hallOfFame.{name}": a for name, a in packGenomes([e.genome for e in population.hallOfFame]).items()})
+    arrays.update({
+        # settings hold no arrays, they are pickled
+        "settings": np.frombuffer(pickle.dumps(population.settings), dtype=np.uint8),
+        "randomState": np.frombuffer(pickle.dumps(random.getstate()), dtype=np.uint8),
+        "populationRandomState": np.frombuffer(pickle.dumps((population.seedSequence, population.rng.getstate())), dtype=np.uint8),
+        "generation": np.array(population.generation),
+        "fitness": np.array([b.fitness for b in brains], dtype=np.float64),
+        "brainGenerations": np.array([b.generation for b in brains], dtype=np.int64),
+        "brains": np.array(brainIndices, dtype=np.int64),
+        "globalChampion": np.array(globalChampion),
+        "hallOfFameFitness": np.array([e.fitness for e in population.hallOfFame], dtype=np.float64),
+        "hallOfFameGenerations": np.array([e.generation for e in population.hallOfFame], dtype=np.int64),
+        "speciesChampions": np.array(speciesChampions, dtype=np.int64),
+        "speciesFitness": np.array([s.fitness for s in population.species], dtype=np.float64),
+        "speciesAvgAdjustedFitness": np.array([s.avgAdjustedFitness for s in population.species], dtype=np.float64),
+        "speciesStaleness": np.array([s.staleness for s in population.species], dtype=np.int64),
+        "speciesOffsets": np.cumsum([0] + [len(m) for m in speciesMembers]),
+        "speciesMembers": np.array([i for m in speciesMembers for i in m], dtype=np.int64),
+        "connectionInnovations": np.array([(i.fromNode, i.toNode, i.innovationNumber) for i in connectionInnovations], dtype=np.int64).reshape(-1, 3),
+        "recurrentInnovations": np.array([(i.fromNode, i.toNode, i.innovationNumber) for i in recurrentInnovations], dtype=np.int64).reshape(-1, 3),
+        "nodeInnovations": np.array([(i.connection, i.fromNode, i.toNode, i.innovationNumber) for i in nodeInnovations], dtype=np.int64).reshape(-1, 4),
+        "innovationCounters": np.array([manager.connectionInnovationCounter, manager.nodeInnovationCounter, manager.generation]),
+    })
+
+    # np.savez appends .npz to file names but not to file objects
+    temporary = f"{fileName}.tmp"
+    with open(temporary, "wb") as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, fileName)
+
+def loadCheckpoint(fileName, BrainClass: type, restoreRandomState: bool = True):
+    """
+    Rebuilds the Population saved in param fileName, its brains are instances of param BrainClass
+
+    restoreRandomState: if True, the random module is set back to its state at save time
+    """
+    with np.load(fileName) as f:
+        settings = pickle.loads(f["settings"].tobytes())
+        if restoreRandomState:
+            random.setstate(pickle.loads(f["randomState"].tobytes()))
+
+        manager = InnovationManager(settings.genome, settings.innovationResetInterval, settings.innovationHistoryLimit)
+        manager.connectionInnovationCounter, manager.nodeInnovationCounter, manager.generation = f["innovationCounters"].tolist()
+        for fromNode, toNode, number in f["connectionInnovations"].tolist():
+            manager.connectionInnovationHistory[(fromNode, toNode)] = ConnectionInnovation(fromNode, toNode, number)
+        for fromNode, toNode, number in f["recurrentInnovations"].tolist():
+            manager.recurrentInnovationHistory[(fromNode, toNode)] = ConnectionInnovation(fromNode, toNode, number)
+        for connection, fromNode, toNode, number in f["nodeInnovations"].tolist():
+            manager.nodeInnovationHistory[(connection, fromNode, toNode)] = NodeInnovation(connection, fromNode, toNode, number)
+
+        brains = []
+        for genome, fitness, generation in zip(unpackGenomes(f, "genome."), f["fitness"].tolist(), f["brainGenerations"].tolist()):
+            brain = BrainClass(genome.toGenome(manager, settings.genome), generation=generation)
+            brain.fitness = fitness
+            brains.append(brain)
+
+        population = Population(settings, BrainClass, manager, [brains[i] for i in f["brains"].tolist()])
+        population.generation = int(f["generation"])
+        population.seedSequence, rngState = pickle.loads(f["populationRandomState"].tobytes())
+        population.rng.setstate(rngState)
+        population.globalChampion = brains[int(f["globalChampion"])]
+        for genome, fitness, generation in zip(unpackGenomes(f, "hallOfFame."), f["hallOfFameFitness"].tolist(), f["hallOfFameGenerations"].tolist()):
+            population.hallOfFame.entries.append(HallOfFameEntry(genome, fitness, generation))
+
+        # every array is read once, indexing f reads it again from the file
+        offsets, members = f["speciesOffsets"].tolist(), f["speciesMembers"].tolist()
+        fitness, avgAdjustedFitness, staleness = (f["speciesFitness"].tolist(), f["speciesAvgAdjustedFitness"].tolist(),
+                                                  f["speciesStaleness"].tolist())
+        for i, champion in enumerate(f["speciesChampions"].tolist()):
+            s = Species(brains[champion])
+            s.champion = brains[champion]
+            s.fitness = float(fitness[i])
+            s.avgAdjustedFitness = float(avgAdjustedFitness[i])
+            s.staleness = int(staleness[i])
+            s.population = [brains[j] for j in members[offsets[i]:offsets[i+1]]]
+            population.species.append(s)
+
+    return population
@@ -0,0 +1,281 @@
+from genome import Genome, hashGenes
+from node import Node
+from connection import Connection
+from phenotype import Phenotype, inputList
+from settings import GenomeSettings
+import numpy as np
+
+class NodeView:
+    """
+    Light read-only view of a node of a CompactGenome
+    """
+    __slots__ = ("genome", "index")
+
+    def __init__(self, genome, index):
+        self.genome = genome
+        self.index = index
+
+    def __str__(self):
+        return f"Node ({self.id}) [{self.layer}]"
+
+    @property
+    def id(self):
+        return int(self.genome.nodeIds[self.index])
+
+    @property
+    def layer(self):
+        return int(self.genome.nodeLayers[self.index])
+
+class ConnectionView:
+    """
+    Light view of a connection of a CompactGenome, weight and enabled can be modified
+    """
+    __slots__ = ("genome", "index")
+
+    def __init__(self, genome, index):
+        self.genome = genome
+        self.index = index
+
+    def __str__(self):
+        arrow = "----" if self.enabled else "/-/-"
+        value = f"[{self.inNode}] {arrow}({self.weight:.3f}){arrow}> [{self.outNode}] I.N.: {self.innovationNumber}"
+        return value + " (recurrent)" if self.recurrent else value
+
+    @property
+    def inNode(self):
+        return int(self.genome.inNodes[self.index])
+
+    @property
+    def outNode(self):
+        return int(self.genome.outNodes[self.index])
+
+    @property
+    def innovationNumber(self):
+        return int(self.genome.innovations[self.index])
+
+    @property
+    def weight(self):
+        return float(self.genome.weights[self.index])
+
+    @weight.setter
+    def weight(self, value):
+        self.genome.weights[self.index] = value
+
+    @property
+    def enabled(self):
+        return bool(self.genome.enabled[self.index])
+
+    @enabled.setter
+    def enabled(self, value):
+        self.genome.enabled[self.index] = value
+
+    @property
+    def recurrent(self):
+        return bool(self.genome.recurrent[self.index])
+
+class CompactGenome:
+    """
+    Struct-of-arrays representation of a genome
+
+    Nodes and connections are stored as parallel NumPy arrays, in the same order as
+    in the genome they come from. This form holds no object references: it is cheap
+    to store, to copy and to pickle, it is used to send genomes to worker processes.
+
+    NodeView and ConnectionView objects can be used to access genes one by one.
+    """
+    __slots__ = ("nodeIds", "nodeLayers", "inNodes", "outNodes", "innovations", "weights", "enabled", "recurrent", "layers")
+
+    def __init__(self, nodeIds, nodeLayers, inNodes, outNodes, innovations, weights, enabled, recurrent, layers):
+        self.nodeIds = np.asarray(nodeIds, dtype=np.int32)
+        self.nodeLayers = np.asarray(nodeLayers, dtype=np.int32)
+
+        self.inNodes = np.asarray(inNodes, dtype=np.int32)
+        self.outNodes = np.asarray(outNodes, dtype=np.int32)
+        self.innovations = np.asarray(innovations, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.enabled = np.asarray(enabled, dtype=bool)
+        self.recurrent = np.asarray(recurrent, dtype=bool)
+
+        self.layers = layers
+
+    def __str__(self):
+        value = "CompactGenome\n\n"
+        value += f"Layers:  {self.layers}\n\n"
+        value += f"Nodes:\n"
+        for node in self.nodes():
+            value += f"{str(node)}\n"
+        value += f"\nConnections:\n"
+        for connection in self.connections():
+            value += f"{str(connection)}\n"
+        return value
+
+    def __getstate__(self):
+        return tuple(getattr(self, a) for a in self.__slots__)
+
+    def __setstate__(self, state):
+        for a, v in zip(self.__slots__, state):
+            setattr(self, a, v)
+
+    @classmethod
+    def fromGenome(cls, genome):
+        nodes = genome.nodes.values()
+        connections = genome.connections.values()
+        return cls([n.id for n in nodes],
+                   [n.layer for n in nodes],
+                   [c.inNode.id for c in connections],
+                   [c.outNode.id for c in connections],
+                   [c.innovationNumber for c in connections],
+                   [c.weight for c in connections],
+                   [c.enabled for c in connections],
+                   [c.recurrent for c in connections],
+                   genome.layers)
+
+    def toGenome(self, manager, settings):
+        """
+        Rebuilds a live Genome
+
+        manager: InnovationManager of the new genome, can be None if it won't be mutated
+        """
+        genome = Genome(manager) # empty genome
+        genome.settings = settings
+        genome.layers = self.layers
+
+        for idNum, layer in zip(self.nodeIds.tolist(), self.nodeLayers.tolist()):
+            genome.nodes[idNum] = Node(idNum, layer)
+
+        for i, o, innovationNumber, weight, enabled, recurrent in zip(self.inNodes.tolist(), self.outNodes.tolist(),
+                                                                      self.innovations.tolist(), self.weights.tolist(),
+                                                                      self.enabled.tolist(), self.recurrent.tolist()):
+            inNode = genome.nodes[i]
+            connection = Connection(inNode, genome.nodes[o], innovationNumber, weight, enabled, recurrent)
+            inNode.addConnection(connection)
+            genome.connections[innovationNumber] = connection
+
+        genome.buildTopology()
+        return genome
+
+    def clone(self):
+        return CompactGenome(self.nodeIds.copy(),
+                             self.nodeLayers.copy(),
+                             self.inNodes.copy(),
+                             self.outNodes.copy(),
+                             self.innovations.copy(),
+                             self.weights.copy(),
+                             self.enabled.copy(),
+                             self.recurrent.copy(),
+                             self.layers)
+
+    def sortedGenes(self):
+        """
+        Same as Genome.sortedGenes(), without rebuilding the Genome
+        """
+        order = np.argsort(self.innovations)
+        return self.innovations[order].astype(np.int64), self.weights[order]
+
+    def structuralHash(self, quantization=1e-9):
+        """
+        Same as Genome.structuralHash(), the same genes get the same key in both forms
+        """
+        return hashGenes(self.innovations[self.enabled], self.weights[self.enabled], quantization)
+
+    def remap(self, mapping: dict):
+        """
+        Replaces the negative (provisional) node ids and innovation numbers using param mapping
+        """
+        for a in (self.nodeIds, self.inNodes, self.outNodes, self.innovations):
+            provisional = a < 0
+            if provisional.any():
+                a[provisional] = [mapping[n] for n in a[provisional].tolist()]
+
+    def save(self, fileName):
+        """
+        Saves this genome in binary form as an uncompressed .npz file named param fileName
+        """
+        # np.savez appends .npz to file names but not to file objects, load() gets the same name
+        with open(fileName, "wb") as f:
+            np.savez(f, **packGenomes([self]))
+
+    @classmethod
+    def load(cls, fileName):
+        with np.load(fileName) as arrays:
+            return unpackGenomes(arrays)[0]
+
+    def nodes(self):
+        return [NodeView(self, i) for i in range(len(self.nodeIds))]
+
+    def connections(self):
+        return [ConnectionView(self, i) for i in range(len(self.innovations))]
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the gene arrays, in bytes
+        """
+        return sum(getattr(self, a).nbytes for a in GENE_ARRAYS)
+
+    def compile(self, settings: GenomeSettings):
+        return Phenotype(zip(self.nodeLayers.tolist(), self.nodeIds.tolist()),
+                         zip(self.inNodes.tolist(), self.outNodes.tolist(), self.weights.tolist(),
+                             self.enabled.tolist(), self.recurrent.tolist()),
+                         settings.inputs + settings.bias, settings.outputs)
+
+    def generateOutputValues(self, inputValues, settings: GenomeSettings):
+        """
+        Forward pass without rebuilding a Genome, the phenotype is not cached
+        """
+        return self.compile(settings).run(inputList(inputValues, settings.inputs) + [1]*settings.bias)
+
+# gene arrays of a CompactGenome and their type
+GENE_ARRAYS = {
+    "nodeIds": np.int32,
+    "nodeLayers": np.int32,
+    "inNodes": np.int32,
+    "outNodes": np.int32,
+    "innovations": np.int32,
+    "weights": np.float64,
+    "enabled": bool,
+    "recurrent": bool,
+}
+
+def packGenomes(genomes):
+    """
+    Concatenates the arrays of param genomes (CompactGenome list)
+
+    returns a dict of flat arrays, the genes of genome i are between
+    nodeOffsets[i] and nodeOffsets[i+1] (connectionOffsets for connections)
+    """
+    arrays = {
+        "nodeOffsets": np.cumsum([0] + [len(g.nodeIds) for g in genomes]),
+        "connectionOffsets": np.cumsum([0] + [len(g.innovations) for g in genomes]),
+        "layers": np.array([g.layers for g in genomes], dtype=np.int32),
+    }
+    for name, dtype in GENE_ARRAYS.items():
+        arrays[name] = np.concatenate([getattr(g, name) for g in genomes] + [np.empty(0, dtype=dtype)])
+    return arrays
+
+def unpackGenomes(arrays, prefix=""):
+    """
+    Inverse of packGenomes, param arrays can be any mapping of the packed arrays
+    such as an opened .npz file, keys can start with param prefix
+    """
+    nodeOffsets = arrays[prefix + "nodeOffsets"]
+    connectionOffsets = arrays[prefix + "connectionOffsets"]
+    genes = {name: arrays[prefix + name] for name in GENE_ARRAYS if prefix + name in arrays}
+    if "recurrent" not in genes:
+        # saved before recurrent connections existed
+        genes["recurrent"] = np.zeros(connectionOffsets[-1], dtype=bool)
+
+    genomes = []
+    for i, layers in enumerate(arrays[prefix + "layers"].tolist()):
+        n = slice(nodeOffsets[i], nodeOffsets[i+1])
+        c = slice(connectionOffsets[i], connectionOffsets[i+1])
+        genomes.append(CompactGenome(genes["nodeIds"][n],
+                                     genes["nodeLayers"][n],
+                                     genes["inNodes"][c],
+                                     genes["outNodes"][c],
+                                     genes["innovations"][c],
+                                     genes["weights"][c],
+                                     genes["enabled"][c],
+                                     genes["recurrent"][c],
+                                     layers))
+    return genomes
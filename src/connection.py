@@ -1,17 +1,22 @@
 import random
 
 class Connection:
-    def __init__(self, inNode, outNode, innovationNumber, weight=0.1, enabled=True):
+    def __init__(self, inNode, outNode, innovationNumber, weight=0.1, enabled=True, recurrent=False):
         self.inNode = inNode
         self.outNode = outNode
         self.innovationNumber = innovationNumber
         self.weight = weight
         self.enabled = enabled
+        # a recurrent connection feeds the value inNode had at the previous step, it is
+        # ignored by the layering and only used by the stateful step mode, see NetworkState
+        self.recurrent = recurrent
     
     def __str__(self):
         pad = " " if self.weight > 0 else ""
         value = f"[{self.inNode.id}-{self.inNode.layer}] ----({pad}{self.weight:.3f})----> [{self.outNode.id}-{self.outNode.layer}]" if self.enabled else f"[{self.inNode.id}] /-/-({pad}{self.weight:.3f})/-/-> [{self.outNode.id}]"
         value += f" I.N.: {self.innovationNumber}"
+        if self.recurrent:
+            value += " (recurrent)"
         return value
     
     def __eq__(self, value):
@@ -24,13 +29,13 @@ class Connection:
         return hash(self.innovationNumber)
 
     def clone(self):
-        return Connection(self.inNode.clone(), self.outNode.clone(), self.innovationNumber, weight=self.weight, enabled=self.enabled)
+        return Connection(self.inNode.clone(), self.outNode.clone(), self.innovationNumber, weight=self.weight, enabled=self.enabled, recurrent=self.recurrent)
 
-    def mutateWeight(self, step, stepRate, newRate):
-        val = random.uniform(-step, step)
-        if random.random() < stepRate:
+    def mutateWeight(self, step, stepRate, newRate, rng=random):
+        val = rng.uniform(-step, step)
+        if rng.random() < stepRate:
             self.weight += val
             if self.weight > 4.0: self.weight = 4.0
             elif self.weight < -4.0: self.weight = -4.0
-        elif random.random() < newRate:
+        elif rng.random() < newRate:
             self.weight = val
@@ -0,0 +1,59 @@
+from settings import DistanceSettings
+import numpy as np
+
+def compatibility(counts, otherCounts, common, weightDifference, settings: DistanceSettings):
+    """
+    Compatibility distance formula, works on scalars as well as arrays
+
+    counts, otherCounts: number of genes of each genome
+
+    common: number of matching genes
+
+    weightDifference: sum of the absolute weight differences of the matching genes
+    """
+    N = np.maximum(counts, otherCounts)
+    N = np.where(N < 20, 1, N)
+    # genomes without matching genes have no weight term
+    weightTerm = np.divide(weightDifference, common, out=np.zeros_like(weightDifference, dtype=np.float64), where=common > 0)
+
+    return settings.coeffDisjoint * (counts + otherCounts - 2*common) / N + settings.coeffWeights * weightTerm
+
+def distance(innovations, weights, otherInnovations, otherWeights, settings: DistanceSettings):
+    """
+    Distance between two genomes given their genes sorted by innovation number
+    """
+    _, i, j = np.intersect1d(innovations, otherInnovations, assume_unique=True, return_indices=True)
+    weightDifference = np.abs(weights[i] - otherWeights[j]).sum()
+
+    return float(compatibility(len(innovations), len(otherInnovations), len(i), weightDifference, settings))
+
+class PackedGenes:
+    """
+    Sorted genes of several genomes concatenated in flat arrays,
+    used to compute the distance from one genome to all of them at once
+    """
+    def __init__(self, genomes):
+        genes = [g.sortedGenes() for g in genomes]
+        self.counts = np.array([len(innovations) for innovations, _ in genes])
+        self.owners = np.repeat(np.arange(len(genes)), self.counts)
+        self.innovations = np.concatenate([innovations for innovations, _ in genes]) if genes else np.empty(0, dtype=np.int64)
+        self.weights = np.concatenate([weights for _, weights in genes]) if genes else np.empty(0)
+
+    def distances(self, genome, settings: DistanceSettings):
+        """
+        Returns the distance between param genome and every packed genome
+        """
+        innovations, weights = genome.sortedGenes()
+        if len(innovations) == 0:
+            return compatibility(0, self.counts, np.zeros(len(self.counts)), np.zeros(len(self.counts)), settings)
+
+        # position of every packed gene in genome's sorted genes
+        positions = np.minimum(np.searchsorted(innovations, self.innovations), len(innovations) - 1)
+        matching = innovations[positions] == self.innovations
+        differences = np.where(matching, np.abs(weights[positions] - self.weights), 0.0)
+
+        size = len(self.counts)
+        common = np.bincount(self.owners, weights=matching, minlength=size)
+        weightDifference = np.bincount(self.owners, weights=differences, minlength=size)
+
+        return compatibility(len(innovations), self.counts, common, weightDifference, settings)
@@ -0,0 +1,75 @@
+import asyncio
+import json
+import numpy as np
+from settings import GenomeSettings, PopulationSettings, EvaluationSettings
+from example_xor import Player
+from neat import NEAT
+
+class Simulator:
+    """
+    Local stand-in for an external simulator
+
+    Receives the outputs of a brain on the XOR cases as a JSON line
+    and answers with their fitness after param latency seconds
+    """
+    def __init__(self, latency=0.01):
+        self.latency = latency
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @staticmethod
+    def score(outputs):
+        # same scoring as Player.fitnessEvaluationBatch
+        expected = Player.tests[:, 2]
+        if np.all((outputs >= 0.5) == expected):
+            return 16
+        return (4 - np.abs(expected - outputs).sum())**2
+
+    async def handle(self, reader, writer):
+        while line := await reader.readline():
+            outputs = np.array(json.loads(line))
+            await asyncio.sleep(self.latency)
+            fitness = self.score(outputs)
+            writer.write(f"{fitness}\n".encode())
+            await writer.drain()
+        writer.close()
+
+class RemotePlayer(Player):
+    # address of the simulator, set before learning
+    address = None
+
+    async def fitnessEvaluationAsync(self):
+        reader, writer = await asyncio.open_connection(*self.address)
+        try:
+            outputs = self.generateOutputValuesBatch(self.batchInputValues)[:, 0]
+            writer.write((json.dumps(outputs.tolist()) + "\n").encode())
+            await writer.drain()
+            return float(await reader.readline())
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+async def main():
+    simulator = Simulator()
+    RemotePlayer.address = await simulator.start()
+
+    genomeSettings = GenomeSettings(inputs=2, outputs=1, bias=1)
+    populationSettings = PopulationSettings(size=150, genomeSettings=genomeSettings,
+                                            evaluationSettings=EvaluationSettings(concurrency=50))
+
+    neat = NEAT(populationSettings, RemotePlayer, headless=True)
+    champion = await neat.learnAsync(iterations=1000, fitnessGoal=16)
+    await simulator.close()
+
+    print(champion)
+    champion.fitnessEvaluation(show=True)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,34 +1,51 @@
 import random
+import numpy as np
 from settings import GenomeSettings, PopulationSettings
-from matplotlib import pyplot as plt
 from population import Population
 from brain import Brain
 from neat import NEAT
 
 class Player(Brain):
+    tests = np.array([(0,0,0),(0,1,1),(1,0,1),(1,1,0)], dtype=np.float64)
+    batchInputValues = tests[:, :2]
+    cases = tests.tolist()
+
     def setInputValues(self, i):
         self.inputValues = [i[0], i[1]]
 
     def fitnessEvaluation(self, show=False):
-        tests = [(0,0,0),(0,1,1),(1,0,1),(1,1,0)]
-
+        # four samples are too few to pay for a batch, they go through the single sample path
         dist = 0
         correct = True
-        for i in tests:
+        for i in self.cases:
             self.setInputValues(i)
             self.generateOutputValues()
-            oo = 0 if self.outputValues[0] < 0.5 else 1
+            result = 0 if self.outputValues[0] < 0.5 else 1
 
             dist += abs(i[2] - self.outputValues[0])
-            if oo != i[2]:
+            if result != i[2]:
                 correct = False
             if show:
-                print(f"i0: {i[0]}, i1: {i[1]}, expected: {i[2]}, result: {oo}")
-        
+                print(f"i0: {int(i[0])}, i1: {int(i[1])}, expected: {int(i[2])}, result: {result}")
+
         if correct:
             return 16
         return (4 - dist)**2
 
+    def fitnessEvaluationBatch(self, outputValues, show=False):
+        outputs = outputValues[:, 0]
+        expected = self.tests[:, 2]
+        results = (outputs >= 0.5).astype(int)
+
+        if show:
+            for i, r in zip(self.tests, results):
+                print(f"i0: {int(i[0])}, i1: {int(i[1])}, expected: {int(i[2])}, result: {r}")
+
+        if np.all(results == expected):
+            return 16
+        dist = np.abs(expected - outputs).sum()
+        return (4 - dist)**2
+
 if __name__ == "__main__":
     #random.seed(1)#2#1
 
@@ -0,0 +1,40 @@
+from collections import OrderedDict
+
+class FitnessCache:
+    """
+    Least recently used cache of fitness values, keyed by Genome.structuralHash()
+
+    Only valid for deterministic fitness functions: two genomes with the same key
+    compute the same outputs and are expected to get the same fitness.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.values = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, key):
+        """
+        Returns the fitness stored under param key, None if there is none
+        """
+        fitness = self.values.get(key)
+        if fitness is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.values.move_to_end(key)
+        return fitness
+
+    def put(self, key, fitness):
+        self.values[key] = fitness
+        self.values.move_to_end(key)
+        while len(self.values) > self.capacity:
+            # evict the least recently used entry
+            self.values.popitem(last=False)
+
+    def clear(self):
+        self.values.clear()
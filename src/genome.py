@@ -1,18 +1,47 @@
 from node import Node
 from connection import Connection
 from innovationManager import InnovationManager
-from settings import GenomeSettings
+from settings import GenomeSettings, MutationSettings
 from errors import InvalidTopologyError
-import matplotlib.pyplot as plt
-import networkx as nx
+from topology import assignLayers
+from phenotype import Phenotype, PopulationPhenotype, NetworkState, inputList
+from distance import distance
+from mutation import mutateWeights
+import numpy as np
+import hashlib
 import random
 import os
 
+def hashGenes(innovations, weights, quantization):
+    """
+    Key of Genome.structuralHash() given the innovation numbers and weights of the enabled connections
+    """
+    order = np.argsort(innovations)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(innovations[order].astype(np.int64).tobytes())
+    digest.update(np.round(weights[order] / quantization).astype(np.int64).tobytes())
+    return digest.digest()
+
 class Genome:
+    # number of clones made since the program started, used for instrumentation
+    clones = 0
+
     def __init__(self, innovationManager, settings: GenomeSettings=None):
         self.innovationManager: InnovationManager = innovationManager
 
-        self.network = []
+        # compiled network, sorted genes and CompactGenome copy, built on demand and dropped
+        # whenever the genome changes
+        self.phenotype: Phenotype = None
+        self.genes = None
+        self.compact = None
+
+        # topology, kept up to date by createConnection and mutateAddNode
+        # layerNodes: nodes of every layer
+        # freeTargets: number of nodes a node could still connect to, by node id
+        # connectedPairs: (inNode id, outNode id) of every connection
+        self.layerNodes = []
+        self.freeTargets = {}
+        self.connectedPairs = set()
 
         if settings is None: # create empty Genome
             self.nodes = {}
@@ -28,43 +57,42 @@ class Genome:
         self.nodes = {i: Node(i, 0) for i in range(inputs + bias)}
         self.nodes.update({i: Node(i, 1) for i in range(inputs + bias, inputs + bias + outputs)})
 
+        self.layerNodes = [self.inputNodes(), self.outputNodes()]
+        self.freeTargets = {n.id: outputs for n in self.layerNodes[0]}
+        self.freeTargets.update({n.id: 0 for n in self.layerNodes[1]})
+
+        # genome is fully connected on creation
         self.connections = {}
         for n1 in self.inputNodes():
             for n2 in self.outputNodes():
                 self.createConnection(n1, n2)
 
-        # genome is fully connected on creation
-        self.availableNodes = set()
-        self.maxConnectionsPerLayer = [(inputs + bias) * outputs, 0]
-
     @classmethod
     def fromFile(cls, fileName, manager: InnovationManager, settings: GenomeSettings):
         with open(fileName, "r") as f:
             genome = cls(manager) # empty genome
             lines = f.readlines()
             genes = [l.split() for l in lines]
-            maxLayer = 0
             for g in genes:
                 if g[0] == "node":
                     idNum = int(g[1])
-                    layer = int(g[2])
-                    genome.nodes[idNum] = Node(idNum, layer)
-                    if layer > maxLayer:
-                        maxLayer = layer
+                    genome.nodes[idNum] = Node(idNum, int(g[2]))
                 elif g[0] == "connection":
                     inNode = genome.nodes[int(g[1])]
                     outNode = genome.nodes[int(g[2])]
                     innovationNumber = int(g[3])
                     weight = float(g[4])
                     enabled = g[5] == "1"
+                    recurrent = len(g) > 6 and g[6] == "1"
 
-                    connection = Connection(inNode, outNode, innovationNumber, weight, enabled)
+                    connection = Connection(inNode, outNode, innovationNumber, weight, enabled, recurrent)
                     inNode.addConnection(connection)
                     genome.connections[innovationNumber] = connection
 
             genome.settings = settings
-            genome.layers = maxLayer + 1
-            genome.updateAvailableNodes()
+            # layers are recomputed so that hand written or outdated files stay valid
+            genome.layers = assignLayers(genome.nodes, range(len(genome.inputNodes())), [n.id for n in genome.outputNodes()])
+            genome.buildTopology()
 
             return genome
 
@@ -94,7 +122,7 @@ class Genome:
                 f.write(f"node {n.id} {n.layer}\n")
             # write connection
             for c in self.connections.values():
-                f.write(f"connection {c.inNode.id} {c.outNode.id} {c.innovationNumber} {c.weight} {1 if c.enabled else 0}\n")
+                f.write(f"connection {c.inNode.id} {c.outNode.id} {c.innovationNumber} {c.weight} {1 if c.enabled else 0} {1 if c.recurrent else 0}\n")
 
     def inputNodes(self):
         # input + bias
@@ -104,6 +132,10 @@ class Genome:
         return [self.nodes[i + self.settings.inputs + self.settings.bias] for i in range(self.settings.outputs)]
 
     def plot(self, block=False, pauseTime=1.0, fname=None):
+        # plotting libraries are only loaded when needed, headless runs never import them
+        import matplotlib.pyplot as plt
+        import networkx as nx
+
         # TODO add title
         G = nx.DiGraph()
 
@@ -154,164 +186,290 @@ class Genome:
         else:
             plt.pause(pauseTime)
 
-    def updateAvailableNodes(self):
+    def buildTopology(self):
         """
-        Updates the self.availableNodes set.
+        Builds self.layerNodes, self.freeTargets and self.connectedPairs from scratch
 
-        self.availableNodes will contain nodes that can be used to create a new connection
+        Only needed when a genome is assembled from its genes, mutations keep them up to date
         """
-        layerNodes = [set() for _ in range(self.layers)]
-        nodes = self.nodes.values()
+        self.layerNodes = [[] for _ in range(self.layers)]
+        for node in self.nodes.values():
+            self.layerNodes[node.layer].append(node)
 
-        for node in nodes:
-            layerNodes[node.layer].add(node)
+        self.freeTargets = {}
+        for node in self.nodes.values():
+            connected = sum(1 for c in node.outputs if not c.recurrent and c.outNode.layer > node.layer)
+            self.freeTargets[node.id] = self.nodesAbove(node.layer) - connected
 
-        maxConnectionsPerLayer = [set() for _ in range(self.layers)]
-        possibleConnections = set()
-        for i in reversed(range(self.layers)):
-            maxConnectionsPerLayer[i].update(possibleConnections)
-            possibleConnections.update(layerNodes[i])
-        
-        self.maxConnectionsPerLayer = [len(maxConnectionsPerLayer[i]) for i in range(self.layers)]
-        self.availableNodes = set()
-        
-        for node in nodes:
-            connectedTo = set(map(lambda c: c.outNode, node.outputs))
-            availableToConnect = maxConnectionsPerLayer[node.layer].difference(connectedTo)
-            if len(availableToConnect) > 0:
-                self.availableNodes.update(availableToConnect)
-                self.availableNodes.add(node)
-
-    def generateNetwork(self):
-        if len(self.network) == len(self.nodes):
-            return
-        # first sort key is layer, second is id to make sure inputs and outputs are ordered
-        self.network = sorted(self.nodes.values(), key=lambda n: (n.layer, n.id))
+        self.connectedPairs = {(c.inNode.id, c.outNode.id) for c in self.connections.values() if not c.recurrent}
+
+    def nodesAbove(self, layer):
+        """
+        Returns the number of nodes in the layers above param layer
+        """
+        return sum(len(nodes) for nodes in self.layerNodes[layer + 1:])
+
+    def invalidate(self):
+        """
+        Drops the data derived from the genes, to call whenever the genome changes
+        """
+        self.phenotype = None
+        self.genes = None
+        self.compact = None
 
-    def mutateAddConnection(self):
-        if len(self.availableNodes) < 2:
+    def sortedGenes(self):
+        """
+        Returns the innovation numbers and weights of the connections, sorted by innovation number
+        """
+        if self.genes is None:
+            innovations = np.fromiter(self.connections, dtype=np.int64, count=len(self.connections))
+            weights = np.fromiter((c.weight for c in self.connections.values()), dtype=np.float64, count=len(self.connections))
+            order = np.argsort(innovations)
+            self.genes = (innovations[order], weights[order])
+        return self.genes
+
+    def structuralHash(self, quantization=1e-9):
+        """
+        Returns a key identifying the network of this genome: the innovation numbers of
+        the enabled connections and their weights rounded to param quantization
+        """
+        enabled = [c for c in self.connections.values() if c.enabled]
+        innovations = np.fromiter((c.innovationNumber for c in enabled), dtype=np.int64, count=len(enabled))
+        weights = np.fromiter((c.weight for c in enabled), dtype=np.float64, count=len(enabled))
+        return hashGenes(innovations, weights, quantization)
+
+    def compile(self):
+        """
+        Returns the compiled phenotype of this genome, compiling it if needed
+        """
+        if self.phenotype is None:
+            self.phenotype = Phenotype.fromGenome(self)
+        return self.phenotype
+
+    def isConnected(self, n1, n2):
+        return (n1.id, n2.id) in self.connectedPairs
+
+    def mutateAddConnection(self, rng=random):
+        sources = [n for n in self.nodes.values() if self.freeTargets[n.id] > 0]
+        if len(sources) == 0:
             return
 
-        def getTwoRandomNodes():
-            n1, n2 = random.sample(self.availableNodes, 2)
-            if n1.layer > n2.layer:
-                nTemp = n1
-                n1 = n2
-                n2 = nTemp
-            return n1, n2
+        # picking the source w.r.t. its number of free targets and then one of
+        # these targets samples uniformly among all the possible new connections
+        n1 = rng.choices(sources, weights=[self.freeTargets[n.id] for n in sources])[0]
+        targets = [n for nodes in self.layerNodes[n1.layer + 1:] for n in nodes if not self.isConnected(n1, n)]
+        n2 = rng.choice(targets)
 
-        n1, n2 = getTwoRandomNodes()
+        self.createConnection(n1, n2, weight=rng.uniform(-2,2))
 
-        while n1.layer == n2.layer or n1.isConnectedTo(n2):
-            n1, n2 = getTwoRandomNodes()
+    def mutateAddRecurrentConnection(self, rng=random):
+        """
+        Adds a recurrent connection from a random node to a node of the same or of a lower layer
+        """
+        recurrentPairs = {(c.inNode.id, c.outNode.id) for c in self.connections.values() if c.recurrent}
+        inputs = self.settings.inputs + self.settings.bias
+
+        n1 = rng.choice(list(self.nodes.values()))
+        targets = [n for n in self.nodes.values() if n.id >= inputs and n.layer <= n1.layer and (n1.id, n.id) not in recurrentPairs]
+        if len(targets) == 0:
+            return
+
+        n2 = rng.choice(targets)
+        self.createConnection(n1, n2, weight=rng.uniform(-2,2), recurrent=True)
 
-        self.createConnection(n1, n2, weight=random.uniform(-2,2))
-    
-        if len(n1.outputs) == self.maxConnectionsPerLayer[n1.layer]:
-            self.availableNodes.discard(n1)
+    def mutateAddNode(self, rng=random):
+        # recurrent connections are never split, they are not part of the layering
+        oldConnection = rng.sample([c for c in self.connections.values() if not c.recurrent], 1)[0]
+        n1, n2 = self.nodes[oldConnection.inNode.id], self.nodes[oldConnection.outNode.id]
+
+        newId = self.innovationManager.getNodeId(oldConnection.innovationNumber, oldConnection.inNode.id, oldConnection.outNode.id)
+        if newId in self.nodes:
+            # this connection has already been split in this genome
+            return
 
-    def mutateAddNode(self):
         # disable old connection
-        oldConnection = random.sample(list(self.connections.values()), 1)[0]
         oldConnection.enabled = False
-        n1, n2 = self.nodes[oldConnection.inNode.id], self.nodes[oldConnection.outNode.id]
+        self.invalidate()
 
         # create a new node
-        newId = self.innovationManager.getNodeId(oldConnection.innovationNumber, oldConnection.inNode.id, oldConnection.outNode.id)
         newNode = Node(id=newId, layer=n1.layer + 1)
 
         # shift upper layers if necessary to respect the topological order
+        # splitting a connection only ever needs one new layer, so the layering is updated in
+        # place rather than recomputed with assignLayers, which keeps layerNodes and freeTargets valid
         if newNode.layer == n2.layer:
             self.layers += 1
+            self.layerNodes.insert(newNode.layer, [])
             for node in self.nodes.values():
                 if node.layer >= newNode.layer:
                     node.layer += 1
 
+        # newNode is a new possible target for every node below it
+        for nodes in self.layerNodes[:newNode.layer]:
+            for node in nodes:
+                self.freeTargets[node.id] += 1
+
         self.nodes[newId] = newNode
+        self.layerNodes[newNode.layer].append(newNode)
+        self.freeTargets[newId] = self.nodesAbove(newNode.layer)
 
         # add connection n1 --1.0--> newNode
         self.createConnection(n1, newNode, 1.0)
         # add connection newNode --weight--> n2
         self.createConnection(newNode, n2, oldConnection.weight)
 
-        self.updateAvailableNodes()
-
     def mutateReenable(self):
         for c in self.connections.values():
             if not c.enabled:
                 c.enabled = True
+                self.invalidate()
                 break
 
-    def mutateToggleEnabled(self):
-        connection = random.sample(list(self.connections.values()), 1)[0]
+    def mutateToggleEnabled(self, rng=random):
+        connection = rng.sample(list(self.connections.values()), 1)[0]
 
         if connection.enabled:
             for c in connection.inNode.outputs:
-                if c.enabled and c.innovationNumber != connection.innovationNumber:
+                if c.enabled and not c.recurrent and c.innovationNumber != connection.innovationNumber:
                     connection.enabled = False
+                    self.invalidate()
                     break
         else:
             connection.enabled = True
+            self.invalidate()
 
-    def mutateWeight(self):
+    def mutateWeight(self, rng=random):
+        self.invalidate()
         for c in self.connections.values():
             if c.enabled:
                 c.mutateWeight(self.settings.mutation.weightMutationStep,
                                self.settings.mutation.weightMutationStepRate,
-                               self.settings.mutation.weightMutationNewRate)
+                               self.settings.mutation.weightMutationNewRate,
+                               rng)
+
+    @classmethod
+    def mutateWeights(cls, batch, settings: MutationSettings, generator: np.random.Generator):
+        """
+        Mutates the weights of param batch in a single vectorized operation, worth it for
+        many genomes at once
 
-    def mutate(self):
+        batch: (genome, connections) pairs, only the given connections of every genome are
+        mutated. genome can also be a CompactGenome, connections is then a boolean mask
+        of its connections
+        """
+        if len(batch) == 0:
+            return
+        weights = [np.array([c.weight for c in cs]) if type(cs) is list else g.weights[cs] for g, cs in batch]
+        mutated = mutateWeights(np.concatenate(weights), settings, generator).tolist()
+
+        offset = 0
+        for (g, cs), w in zip(batch, weights):
+            values = mutated[offset:offset + len(w)]
+            offset += len(w)
+            if type(cs) is list:
+                for c, v in zip(cs, values):
+                    c.weight = v
+                g.invalidate()
+            else:
+                g.weights[cs] = values
+
+    def mutate(self, rng=random, weightBatch: list = None):
+        """
+        rng: source of randomness, the random module or a random.Random instance
+
+        weightBatch: if given, the weight mutation is not applied, this genome and its
+        connections enabled at that point are appended to the list instead, its caller
+        mutates the whole batch with mutateWeights()
+        """
         if len(self.connections) == 0:
-            self.mutateAddConnection()
+            self.mutateAddConnection(rng)
 
         # add connection
-        if random.random() < self.settings.mutation.addConnectionMutationRate:
-            self.mutateAddConnection()
+        if rng.random() < self.settings.mutation.addConnectionMutationRate:
+            self.mutateAddConnection(rng)
         # add node
-        elif random.random() < self.settings.mutation.addNodeMutationRate:
-            self.mutateAddNode()
+        elif rng.random() < self.settings.mutation.addNodeMutationRate:
+            self.mutateAddNode(rng)
+        # add recurrent connection, no number is drawn when disabled so that runs without
+        # recurrent connections make the same random choices as before they existed
+        elif self.settings.mutation.addRecurrentConnectionMutationRate > 0 and rng.random() < self.settings.mutation.addRecurrentConnectionMutationRate:
+            self.mutateAddRecurrentConnection(rng)
         else:          
             # mutate weights
-            if random.random() < self.settings.mutation.weightMutationRate:
-                self.mutateWeight()
+            if rng.random() < self.settings.mutation.weightMutationRate:
+                if weightBatch is None:
+                    self.mutateWeight(rng)
+                else:
+                    weightBatch.append((self, [c for c in self.connections.values() if c.enabled]))
             
             # toggle enabled field in a random connection
-            if random.random() < self.settings.mutation.togglesEnableMutationRate:
-                self.mutateToggleEnabled()
+            if rng.random() < self.settings.mutation.togglesEnableMutationRate:
+                self.mutateToggleEnabled(rng)
 
             # reenable a disabled connection
-            if random.random() < self.settings.mutation.reEnableMutationRate:
+            if rng.random() < self.settings.mutation.reEnableMutationRate:
                 self.mutateReenable()
 
-    def createConnection(self, n1, n2, weight=0.1):
-        innovationNumber = self.innovationManager.getConnectionInnovationNumber(n1.id, n2.id)
-        newConnection = Connection(n1, n2, innovationNumber, weight)
+    def createConnection(self, n1, n2, weight=0.1, recurrent=False):
+        if recurrent:
+            innovationNumber = self.innovationManager.getRecurrentInnovationNumber(n1.id, n2.id)
+        else:
+            innovationNumber = self.innovationManager.getConnectionInnovationNumber(n1.id, n2.id)
+        newConnection = Connection(n1, n2, innovationNumber, weight, recurrent=recurrent)
         n1.addConnection(newConnection)
         self.connections[innovationNumber] = newConnection
+        if not recurrent:
+            self.freeTargets[n1.id] -= 1
+            self.connectedPairs.add((n1.id, n2.id))
+        self.invalidate()
 
     def generateOutputValues(self, inputValues):
-        # ordering nodes according to their respective layer and id
-        self.generateNetwork()
+        inputs = inputList(inputValues, self.settings.inputs) + [1]*self.settings.bias
 
-        inputs = inputValues + [1]*self.settings.bias
+        # forward pass on the compiled network, reused until the genome changes
+        return self.compile().run(inputs)
 
-        # setting input values to the input nodes
-        for i in range(self.settings.inputs + self.settings.bias):
-            self.network[i].value = inputs[i]
+    def createState(self):
+        """
+        Returns a NetworkState running the compiled network one step at a time, it is only
+        valid until the genome changes
+        """
+        return NetworkState(self.compile(), self.settings.bias)
 
-        # resetting to 0 the values of every other nodes
-        for i in range(self.settings.inputs + self.settings.bias, len(self.nodes)):
-            self.network[i].value = 0
+    def generateOutputValuesBatch(self, inputValues):
+        """
+        Evaluates several input samples in one vectorized forward pass
 
-        # forward pass
-        for node in self.network:
-            node.forward()
+        inputValues: ndarray of shape [N, inputs]
 
-        outputs = list(map(lambda n: n.value, self.network[-self.settings.outputs:]))
-        return outputs
+        returns an ndarray of shape [N, outputs]
+        """
+        return self.compile().activate(self.addBias(inputValues))
 
     @classmethod
-    def crossover(cls, first, second, sameFitness=False):
+    def generateOutputValuesPopulation(cls, genomes, inputValues):
+        """
+        Evaluates the same input samples on every genome of param genomes in one vectorized pass
+
+        inputValues: ndarray of shape [N, inputs]
+
+        returns an ndarray of shape [genomes, N, outputs]
+        """
+        network = PopulationPhenotype.fromGenomes(genomes)
+        return network.activate(genomes[0].addBias(inputValues))
+
+    def addBias(self, inputValues):
+        """
+        Appends the bias column to a [N, inputs] batch of input values
+        """
+        inputValues = np.asarray(inputValues, dtype=np.float64)
+        if self.settings.bias:
+            bias = np.ones((len(inputValues), self.settings.bias))
+            inputValues = np.concatenate((inputValues, bias), axis=1)
+        return inputValues
+
+    @classmethod
+    def crossover(cls, first, second, sameFitness=False, rng=random):
         """
         Generates the crossover child between param first and param second
         
@@ -320,6 +478,8 @@ class Genome:
         first: Genome
 
         second: Genome
+
+        rng: source of randomness, the random module or a random.Random instance
         """
 
         child = cls(first.innovationManager)
@@ -327,7 +487,7 @@ class Genome:
 
         # randomly add common connections (matching genes)
         common = set(first.connections).intersection(set(second.connections))
-        connections = [first.connections[c] if random.random() < 0.5 else second.connections[c] for c in common]
+        connections = [first.connections[c] if rng.random() < 0.5 else second.connections[c] for c in common]
 
         # add excess and disjoint genes from the most fit parent or from the smallest parent if both have the same fitness
         disjointSrc = second if sameFitness and len(first.connections) > len(second.connections) else first
@@ -354,34 +514,14 @@ class Genome:
             enabled = c.enabled
             i = c.innovationNumber
             if i in common and not (first.connections[i].enabled and second.connections[i].enabled):
-                enabled = random.random() < 0.25
+                enabled = rng.random() < 0.25
 
-            connection = Connection(inNode, outNode, c.innovationNumber, c.weight, enabled)
+            connection = Connection(inNode, outNode, c.innovationNumber, c.weight, enabled, c.recurrent)
             inNode.addConnection(connection)
             child.connections[connection.innovationNumber] = connection
 
-        # compute layers
-        queue = []
-
-        for n in child.inputNodes():
-            queue.append(n)
-
-        maxLayer = 1
-
-        while len(queue) > 0:
-            node = queue.pop()
-            for n in node.neighbours():
-                if n.layer <= node.layer:
-                    n.layer = node.layer + 1
-                    if n.layer > maxLayer:
-                        maxLayer += 1
-                queue.insert(0, n)
-        
-        child.layers = maxLayer + 1
-        for n in child.outputNodes():
-            n.layer = maxLayer
-
-        child.updateAvailableNodes()
+        child.layers = assignLayers(child.nodes, range(len(child.inputNodes())), [n.id for n in child.outputNodes()])
+        child.buildTopology()
 
         # if False and not child.isTopologyValid():
         #     # make sure that the crossover worked correctly
@@ -390,6 +530,7 @@ class Genome:
         return child
 
     def clone(self):
+        Genome.clones += 1
         copy = Genome(self.innovationManager)
         copy.settings = self.settings
         copy.layers = self.layers
@@ -403,16 +544,23 @@ class Genome:
             inNode = copy.nodes[c.inNode.id]
             outNode = copy.nodes[c.outNode.id]
 
-            connection = Connection(inNode, outNode, c.innovationNumber, c.weight, c.enabled)
+            connection = Connection(inNode, outNode, c.innovationNumber, c.weight, c.enabled, c.recurrent)
             inNode.addConnection(connection)
             copy.connections[connection.innovationNumber] = connection
 
-        copy.updateAvailableNodes()
+        copy.layerNodes = [[copy.nodes[n.id] for n in nodes] for nodes in self.layerNodes]
+        copy.freeTargets = dict(self.freeTargets)
+        copy.connectedPairs = set(self.connectedPairs)
+
+        # same genes, the compiled network stays valid until one of the copies mutates
+        copy.phenotype = self.phenotype
+        copy.genes = self.genes
+        copy.compact = self.compact
         return copy
 
     def isTopologyValid(self):
         for c in self.connections.values():
-            if c.inNode.layer >= c.outNode.layer:
+            if not c.recurrent and c.inNode.layer >= c.outNode.layer:
                 return False
         if len(self.connections) > 0:
             # inputs
@@ -430,17 +578,4 @@ class Genome:
         """
         Compute the distance between self and param genome
         """
-        n1 = len(self.connections)
-        n2 = len(genome.connections)
-        N = max(n1, n2)
-        if N < 20:
-            N = 1
-
-        common = set(self.connections).intersection(set(genome.connections))
-        weightDistance = 0
-
-        for c in common:
-            weightDistance += abs(self.connections[c].weight - genome.connections[c].weight)
-
-        return self.settings.distance.coeffDisjoint * (n1 + n2 - 2*len(common)) / N + \
-               self.settings.distance.coeffWeights * weightDistance / len(common)
+        return distance(*self.sortedGenes(), *genome.sortedGenes(), self.settings.distance)
@@ -0,0 +1,65 @@
+from collections import deque
+from compactGenome import CompactGenome, GENE_ARRAYS
+from innovationManager import InnovationManager
+from settings import GenomeSettings
+
+class HallOfFameEntry:
+    """
+    Frozen record of a champion: its genome as read-only arrays, its fitness and the
+    generation it was born in
+    """
+    __slots__ = ("genome", "fitness", "generation")
+
+    def __init__(self, genome: CompactGenome, fitness, generation):
+        for a in GENE_ARRAYS:
+            getattr(genome, a).setflags(write=False)
+        self.genome = genome
+        self.fitness = fitness
+        self.generation = generation
+
+    def __str__(self):
+        return f"Champion - Fitness: {self.fitness} - Generation: {self.generation} - Neurons: {len(self.genome.nodeIds) + len(self.genome.innovations)}"
+
+    def toBrain(self, BrainClass: type, manager: InnovationManager, settings: GenomeSettings):
+        """
+        Rebuilds a live brain of param BrainClass from this entry
+        """
+        brain = BrainClass(self.genome.toGenome(manager, settings), generation=self.generation)
+        brain.fitness = self.fitness
+        return brain
+
+class HallOfFame:
+    """
+    The last global champions of a population, oldest first
+
+    Champions are kept as HallOfFameEntry, holding no Node or Connection object.
+    When capacity is reached the oldest champion is forgotten.
+    """
+    def __init__(self, capacity: int = None):
+        """
+        capacity: maximum number of champions kept, unbounded if None
+        """
+        self.capacity = capacity
+        self.entries = deque(maxlen=capacity)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    def add(self, brain):
+        """
+        Records param brain, a frozen copy of its genome is made
+        """
+        self.entries.append(HallOfFameEntry(brain.toCompact().clone(), brain.fitness, brain.generation))
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the gene arrays of the entries, in bytes
+        """
+        return sum(e.genome.nbytes for e in self.entries)
@@ -20,45 +20,143 @@ class NodeInnovation:
         self.innovationNumber: int = innovationNumber
 
 class InnovationManager:
-    def __init__(self, genomeSettings: GenomeSettings):
+    """
+    Keeps track of the innovations created during evolution so that the same structural
+    mutation gets the same innovation number in every genome
+
+    Innovations are indexed by (fromNode, toNode) for connections and
+    by (connection, fromNode, toNode) for nodes. Recurrent connections have their own
+    table, they share the innovation numbers of connections.
+
+    resetInterval: if > 0, innovation tables are cleared every resetInterval generations,
+    mutations happening after a reset always get new innovation numbers
+
+    historyLimit: if not None, maximum number of innovations kept in each table,
+    the oldest ones are forgotten first
+    """
+    def __init__(self, genomeSettings: GenomeSettings, resetInterval: int = 0, historyLimit: int = None):
         self.connectionInnovationCounter = 0
-        self.connectionInnovationHistory = []
+        self.connectionInnovationHistory = {}
+        self.recurrentInnovationHistory = {}
 
         self.nodeInnovationCounter = genomeSettings.inputs + genomeSettings.outputs + genomeSettings.bias
-        self.nodeInnovationHistory = []
+        self.nodeInnovationHistory = {}
+
+        self.resetInterval = resetInterval
+        self.historyLimit = historyLimit
+        self.generation = 0
+
+    def newGeneration(self):
+        """
+        Applies the reset policy, to be called once per generation
+        """
+        self.generation += 1
+        if self.resetInterval > 0 and self.generation % self.resetInterval == 0:
+            self.connectionInnovationHistory.clear()
+            self.recurrentInnovationHistory.clear()
+            self.nodeInnovationHistory.clear()
+
+    def registerGenome(self, genome):
+        """
+        Records the innovations of a genome created by another manager,
+        new innovations won't reuse its node ids and innovation numbers
+        """
+        for c in genome.connections.values():
+            key = (c.inNode.id, c.outNode.id)
+            history = self.recurrentInnovationHistory if c.recurrent else self.connectionInnovationHistory
+            if key not in history:
+                history[key] = ConnectionInnovation(*key, c.innovationNumber)
+            self.connectionInnovationCounter = max(self.connectionInnovationCounter, c.innovationNumber + 1)
+        for n in genome.nodes:
+            self.nodeInnovationCounter = max(self.nodeInnovationCounter, n + 1)
 
+    def replay(self, requests, mapping: dict):
+        """
+        Applies the requests recorded by an InnovationRecorder, in order
+
+        mapping: filled with the final number of every provisional number
+        """
+        def resolve(n):
+            return mapping[n] if n < 0 else n
+
+        for r in requests:
+            if r[0] == "connection":
+                number = self.getConnectionInnovationNumber(resolve(r[1]), resolve(r[2]))
+            elif r[0] == "recurrent":
+                number = self.getRecurrentInnovationNumber(resolve(r[1]), resolve(r[2]))
+            else:
+                number = self.getNodeId(resolve(r[1]), resolve(r[2]), resolve(r[3]))
+            if r[-1] < 0:
+                mapping[r[-1]] = number
+
+    def prune(self, history):
+        if self.historyLimit is not None:
+            while len(history) > self.historyLimit:
+                # dicts keep insertion order, the first key is the oldest innovation
+                del history[next(iter(history))]
 
     def getConnectionInnovationNumber(self, fromNode, toNode):
-        innovation = None
-  
+        return self.getInnovationNumber(self.connectionInnovationHistory, fromNode, toNode)
+
+    def getRecurrentInnovationNumber(self, fromNode, toNode):
+        return self.getInnovationNumber(self.recurrentInnovationHistory, fromNode, toNode)
+
+    def getInnovationNumber(self, history, fromNode, toNode):
         # find already existing matching connection
-        for innov in self.connectionInnovationHistory:
-            if innov.fromNode == fromNode and innov.toNode == toNode:
-                innovation = innov
-                break
-   
+        innovation = history.get((fromNode, toNode))
+
         if innovation is not None:
             return innovation.innovationNumber
 
         innovation = ConnectionInnovation(fromNode, toNode, self.connectionInnovationCounter)
-        self.connectionInnovationHistory.append(innovation)
+        history[(fromNode, toNode)] = innovation
         self.connectionInnovationCounter += 1
+        self.prune(history)
         return innovation.innovationNumber
 
     def getNodeId(self, connection, fromNode, toNode):
-        innovation = None
-
         # find already existing matching node
-        for innov in self.nodeInnovationHistory:
-            if innov.fromNode == fromNode and innov.toNode == toNode and innov.connection == connection:
-                innovation = innov
-                break
-        
+        innovation = self.nodeInnovationHistory.get((connection, fromNode, toNode))
+
         if innovation is not None:
             return innovation.innovationNumber
 
         innovation = NodeInnovation(connection, fromNode, toNode, self.nodeInnovationCounter)
-        self.nodeInnovationHistory.append(innovation)
+        self.nodeInnovationHistory[(connection, fromNode, toNode)] = innovation
         self.nodeInnovationCounter += 1
+        self.prune(self.nodeInnovationHistory)
         return innovation.innovationNumber
 
+class InnovationRecorder:
+    """
+    Stands in for the InnovationManager where the innovation tables are not available,
+    such as in worker processes
+
+    Every request gets a provisional negative number and is recorded in order, the
+    requests are replayed later on the real manager with InnovationManager.replay().
+
+    knownNodes: node ids of already known (connection, fromNode, toNode) splits,
+    genomes rely on them to know if a connection has already been split
+    """
+    def __init__(self, knownNodes: dict = None):
+        self.knownNodes = knownNodes if knownNodes is not None else {}
+        self.requests = []
+        self.counter = 0
+
+    def getConnectionInnovationNumber(self, fromNode, toNode):
+        self.counter -= 1
+        self.requests.append(("connection", fromNode, toNode, self.counter))
+        return self.counter
+
+    def getRecurrentInnovationNumber(self, fromNode, toNode):
+        self.counter -= 1
+        self.requests.append(("recurrent", fromNode, toNode, self.counter))
+        return self.counter
+
+    def getNodeId(self, connection, fromNode, toNode):
+        number = self.knownNodes.get((connection, fromNode, toNode))
+        if number is None:
+            self.counter -= 1
+            number = self.counter
+        self.requests.append(("node", connection, fromNode, toNode, number))
+        return number
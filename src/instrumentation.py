@@ -0,0 +1,61 @@
+from contextlib import contextmanager
+import json
+import time
+
+class GenerationStats:
+    """
+    Measurements of one generation of a Population, passed to its observers
+
+    timings: wall time of every phase of Population.evolve, in seconds
+
+    innovations: number of connection and node innovations created during the generation
+
+    clones: number of genomes cloned during the generation
+
+    cacheHits: number of brains whose fitness was found in the fitness cache
+
+    champion: global champion brain at the end of the generation, not included in toDict()
+    """
+    def __init__(self, generation):
+        self.generation = generation
+        self.timings = {}
+
+        self.species = 0
+        self.brains = 0
+        self.meanGenomeSize = 0.0
+        self.bestFitness = 0.0
+        self.meanFitness = 0.0
+        self.innovations = 0
+        self.clones = 0
+        self.cacheHits = 0
+        self.newChampion = False
+        self.champion = None
+
+    def __str__(self):
+        timings = " ".join(f"{name}: {t*1000:.3f}ms" for name, t in self.timings.items())
+        return f"Generation {self.generation} - Species: {self.species} - Best fitness: {self.bestFitness} - {timings}"
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Records the time spent in the with block under param name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def toDict(self):
+        return {name: value for name, value in vars(self).items() if name != "champion"}
+
+class JsonLinesSink:
+    """
+    Observer appending the stats of every generation to a file, one JSON object per line
+    """
+    def __init__(self, fileName):
+        self.fileName = fileName
+
+    def __call__(self, stats: GenerationStats):
+        with open(self.fileName, "a") as f:
+            f.write(json.dumps(stats.toDict()) + "\n")
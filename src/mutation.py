@@ -0,0 +1,24 @@
+from settings import MutationSettings
+import numpy as np
+
+# weights are kept in [-MAX_WEIGHT, MAX_WEIGHT] when perturbed
+MAX_WEIGHT = 4.0
+
+def mutateWeights(weights, settings: MutationSettings, generator: np.random.Generator):
+    """
+    Vectorized version of Connection.mutateWeight applied to every weight of param weights
+
+    Each weight is perturbed by a uniform step with probability weightMutationStepRate,
+    otherwise it is replaced by a new uniform value with probability weightMutationNewRate.
+
+    returns the new weights
+    """
+    step = settings.weightMutationStep
+    values = generator.uniform(-step, step, len(weights))
+    draws = generator.random((2, len(weights)))
+
+    perturbed = draws[0] < settings.weightMutationStepRate
+    replaced = ~perturbed & (draws[1] < settings.weightMutationNewRate)
+
+    weights = np.where(perturbed, np.clip(weights + values, -MAX_WEIGHT, MAX_WEIGHT), weights)
+    return np.where(replaced, values, weights)
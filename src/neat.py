@@ -1,27 +1,152 @@
 from population import Population
 from settings import PopulationSettings
 from brain import Brain
+from innovationManager import InnovationManager
+from checkpoint import saveCheckpoint, loadCheckpoint
+from utils import spawnRandom
+
+def plotChampion(champion: Brain):
+    champion.plot(pauseTime=0.0001)
 
 class NEAT:
     def __init__(self,
                  settings: PopulationSettings,
                  BrainClass: type,
-                 baseBrain: Brain = None):
-        if baseBrain is not None:
-            # TODO instantiate population with baseBrain
-            pass
-
-        self.population = Population(settings, BrainClass)
-
-    def learn(self, iterations, fitnessGoal):
-        cnt = 0
-
-        while self.population.globalChampion.fitness < fitnessGoal:
-            cnt += 1
-            if self.population.evolve():
-                self.population.globalChampion.plot(pauseTime=0.0001)
-            if cnt == iterations:
-                break
+                 baseBrain: Brain = None,
+                 population: Population = None,
+                 headless: bool = False,
+                 championReporter = None):
+        """
+        baseBrain: if not None, the population starts with mutated copies of this brain,
+        its genome must have the inputs, outputs and bias of settings.genome
+
+        population: existing population to keep evolving, see NEAT.resume()
+
+        headless: if True, nothing is plotted during learn()
+
+        championReporter: callable receiving every new global champion during learn(),
+        defaults to plotting it unless headless
+        """
+        if championReporter is None and not headless:
+            championReporter = plotChampion
+        self.championReporter = championReporter
+
+        if population is not None:
+            self.population = population
+        elif baseBrain is not None:
+            base = baseBrain.genome
+            if (base.settings.inputs, base.settings.outputs, base.settings.bias) != (settings.genome.inputs, settings.genome.outputs, settings.genome.bias):
+                raise ValueError(f"baseBrain has {base.settings.inputs} inputs, {base.settings.outputs} outputs and {base.settings.bias} bias, "
+                                 f"settings.genome expects {settings.genome.inputs}, {settings.genome.outputs} and {settings.genome.bias}")
+
+            # the copies get a manager following the population settings, it knows the base genome's innovations
+            manager = InnovationManager(settings.genome, settings.innovationResetInterval, settings.innovationHistoryLimit)
+            manager.registerGenome(base)
+
+            brains = []
+            for _ in range(settings.size):
+                genome = base.clone()
+                genome.innovationManager = manager
+                genome.settings = settings.genome
+                brains.append(BrainClass(genome))
+            self.population = Population(settings, BrainClass, manager, brains)
+
+            # keep one unmodified copy of the base brain
+            for b, rng in zip(brains[1:], spawnRandom(self.population.seedSequence, settings.size - 1)):
+                b.mutate(rng)
+        else:
+            self.population = Population(settings, BrainClass)
+
+    @classmethod
+    def resume(cls, fileName, BrainClass: type, headless: bool = False, championReporter = None):
+        """
+        Continues a run from a checkpoint saved by learn()
+        """
+        population = loadCheckpoint(fileName, BrainClass)
+        return cls(population.settings, BrainClass, population=population,
+                   headless=headless, championReporter=championReporter)
+
+    def learn(self, iterations, fitnessGoal, checkpointFile=None, checkpointInterval=0):
+        """
+        Evolves the population until its champion reaches param fitnessGoal
+        or until param iterations generations have been computed
+
+        checkpointFile, checkpointInterval: if set, the population is saved in
+        checkpointFile every checkpointInterval generations
+
+        The worker processes of the "parallel" modes are stopped on return, even on
+        error, they are started again if the population keeps evolving
+        """
+        try:
+            if not self.isDone(iterations, fitnessGoal):
+                for _ in self.generations(checkpointFile, checkpointInterval):
+                    if self.isDone(iterations, fitnessGoal):
+                        break
+        finally:
+            self.population.close()
         print(self.population)
 
-        return self.population.globalChampion
\ No newline at end of file
+        return self.population.globalChampion
+
+    async def learnAsync(self, iterations, fitnessGoal, checkpointFile=None, checkpointInterval=0):
+        """
+        Same as learn() but brains are evaluated concurrently, see Population.evolveAsync
+        """
+        try:
+            if not self.isDone(iterations, fitnessGoal):
+                async for _ in self.generationsAsync(checkpointFile, checkpointInterval):
+                    if self.isDone(iterations, fitnessGoal):
+                        break
+        finally:
+            self.population.close()
+        print(self.population)
+
+        return self.population.globalChampion
+
+    def generations(self, checkpointFile=None, checkpointInterval=0):
+        """
+        Evolves the population one generation at a time, for as long as the caller iterates
+
+        yields the GenerationStats of every generation, its champion attribute
+        is the global champion
+
+        The worker processes of the "parallel" modes are stopped when the generator
+        is closed, which happens as soon as the caller breaks out of the loop
+
+        >for stats in neat.generations():
+        >    if stats.bestFitness > 100 or stats.generation == 500:
+        >        break
+        """
+        try:
+            while True:
+                self.report(self.population.evolve(), checkpointFile, checkpointInterval)
+                yield self.population.lastStats
+        finally:
+            self.population.close()
+
+    async def generationsAsync(self, checkpointFile=None, checkpointInterval=0):
+        """
+        Same as generations() but brains are evaluated concurrently, see Population.evolveAsync
+
+        An async generator is only closed by aclose() or by the event loop, call
+        population.close() after breaking out of the loop
+        """
+        try:
+            while True:
+                self.report(await self.population.evolveAsync(), checkpointFile, checkpointInterval)
+                yield self.population.lastStats
+        finally:
+            self.population.close()
+
+    def isDone(self, iterations, fitnessGoal):
+        # the generation count is kept in the population so that resumed runs stop at the same point
+        return self.population.globalChampion.fitness >= fitnessGoal or self.population.generation >= iterations
+
+    def report(self, newChampion, checkpointFile, checkpointInterval):
+        """
+        Reports the new champion and saves a checkpoint if needed after a generation
+        """
+        if newChampion and self.championReporter is not None:
+            self.championReporter(self.population.globalChampion)
+        if checkpointFile is not None and checkpointInterval > 0 and self.population.generation % checkpointInterval == 0:
+            saveCheckpoint(self.population, checkpointFile)
@@ -0,0 +1,223 @@
+from compactGenome import CompactGenome
+from genome import Genome
+from innovationManager import InnovationManager, InnovationRecorder
+from settings import GenomeSettings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import random
+import math
+import os
+
+# set in every worker process by initWorker
+workerBrainClass = None
+workerSettings = None
+
+def initWorker(BrainClass: type, settings: GenomeSettings):
+    global workerBrainClass, workerSettings
+    workerBrainClass = BrainClass
+    workerSettings = settings
+
+def evaluateChunk(genomes):
+    """
+    Runs in a worker process, returns the fitness of every CompactGenome of param genomes
+    """
+    fitness = []
+    for g in genomes:
+        brain = workerBrainClass(g.toGenome(None, workerSettings))
+        brain.evaluateFitness()
+        fitness.append(brain.fitness)
+    return fitness
+
+def reproduceChunk(chunk, BrainClass: type = None, settings: GenomeSettings = None):
+    """
+    Runs in a worker process, builds the offspring described by param chunk
+
+    chunk: (parents, tasks, knownNodes), parents are (CompactGenome, fitness, generation)
+    tuples and tasks are (first, second, seed) tuples, first and second being indices in
+    parents (second is -1 for a mutated clone)
+
+    returns a (CompactGenome, fitness, generation, mutateWeights) tuple for every offspring
+    along with the innovation requests made while building them and the number of genomes
+    cloned. mutateWeights is None or, if the weights of the offspring still have to be
+    mutated, the mask of the connections to mutate, see Genome.mutate()
+    """
+    BrainClass = BrainClass or workerBrainClass
+    settings = settings or workerSettings
+    parents, tasks, knownNodes = chunk
+
+    clones = Genome.clones
+    recorder = InnovationRecorder(knownNodes)
+    brains = []
+    for genome, fitness, generation in parents:
+        brain = BrainClass(genome.toGenome(recorder, settings), generation=generation)
+        brain.fitness = fitness
+        brains.append(brain)
+
+    offspring = []
+    for first, second, seed in tasks:
+        weightBatch = []
+        child = BrainClass.offspring(brains[first], brains[second] if second >= 0 else None, random.Random(seed), weightBatch)
+        mutateWeights = None
+        if len(weightBatch) > 0:
+            deferred = {id(c) for c in weightBatch[0][1]}
+            mutateWeights = np.array([id(c) in deferred for c in child.genome.connections.values()], dtype=bool)
+        offspring.append((CompactGenome.fromGenome(child.genome), child.fitness, child.generation, mutateWeights))
+    return offspring, recorder.requests, Genome.clones - clones
+
+class WorkerPool:
+    """
+    Pool of worker processes used to evaluate and to reproduce brains
+
+    Genomes are sent as CompactGenome and rebuilt in the workers as instances of BrainClass.
+    Chunks that fail are retried on a new pool, up to maxRetries times, and are then
+    processed in the current process.
+    """
+    def __init__(self, BrainClass: type, settings: GenomeSettings, workers=None, maxRetries=1):
+        self.BrainClass = BrainClass
+        self.settings = settings
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.maxRetries = maxRetries
+
+        self.executor = None
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                initializer=initWorker,
+                                                initargs=(self.BrainClass, self.settings))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    def split(self, items, chunkSize=None):
+        chunkSize = chunkSize or max(1, math.ceil(len(items) / (4 * self.workers)))
+        return [items[i:i+chunkSize] for i in range(0, len(items), chunkSize)]
+
+    def run(self, function, payloads):
+        """
+        Calls param function on every payload in the pool
+
+        returns the results in order, None for the payloads that failed after every retry
+        """
+        results = [None] * len(payloads)
+        pending = list(range(len(payloads)))
+
+        for _ in range(self.maxRetries + 1):
+            if len(pending) == 0:
+                break
+            self.start()
+            futures = []
+            failed = []
+            broken = False
+            for i in pending:
+                try:
+                    futures.append((i, self.executor.submit(function, payloads[i])))
+                except BrokenProcessPool:
+                    broken = True
+                    failed.append(i)
+
+            for i, future in futures:
+                try:
+                    results[i] = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    failed.append(i)
+                except Exception:
+                    failed.append(i)
+
+            # a worker died, the pool can't be used anymore
+            if broken:
+                self.close()
+            pending = sorted(failed)
+
+        return results
+
+    def evaluate(self, brains, chunkSize=None):
+        """
+        Sets the fitness of every brain of param brains
+        """
+        chunks = self.split(brains, chunkSize)
+        payloads = [[b.toCompact() for b in chunk] for chunk in chunks]
+
+        for chunk, fitness in zip(chunks, self.run(evaluateChunk, payloads)):
+            if fitness is None:
+                # last resort, evaluate in this process
+                for b in chunk:
+                    b.evaluateFitness()
+            else:
+                for b, f in zip(chunk, fitness):
+                    b.fitness = f
+
+    def reproduce(self, tasks, manager: InnovationManager, weightBatch: list, chunkSize=None):
+        """
+        Builds the offspring of param tasks, a list of (first, second, seed) tuples as
+        used by Brain.offspring(first, second, random.Random(seed), weightBatch)
+
+        The innovations requested by the workers are replayed on param manager chunk
+        by chunk, in order, so they get the same numbers as with a serial reproduction.
+        Workers get the node splits known before the call, param manager must not have
+        a historyLimit: it could forget some of them while earlier chunks are replayed.
+        The offspring are made with BrainClass.fromCompact(), their Genome is only rebuilt
+        in this process if it is needed
+
+        weightBatch: (CompactGenome, mask) of the offspring whose weights are left to mutate
+        are appended to it, in order, see Genome.mutateWeights()
+
+        returns the list of offspring
+        """
+        # CompactGenome and known node splits of every parent, parents appear in many chunks
+        genes = {}
+        def parentGenes(p):
+            if id(p) not in genes:
+                genome = p.toCompact()
+                knownNodes = {}
+                for key in zip(genome.innovations.tolist(), genome.inNodes.tolist(), genome.outNodes.tolist()):
+                    innovation = manager.nodeInnovationHistory.get(key)
+                    if innovation is not None:
+                        knownNodes[key] = innovation.innovationNumber
+                genes[id(p)] = (genome, knownNodes)
+            return genes[id(p)]
+
+        payloads = []
+        for chunk in self.split(tasks, chunkSize):
+            # every parent is sent once per chunk
+            indices = {}
+            parents = []
+            for first, second, _ in chunk:
+                for p in (first, second):
+                    if p is not None and id(p) not in indices:
+                        indices[id(p)] = len(parents)
+                        parents.append(p)
+
+            knownNodes = {}
+            for p in parents:
+                knownNodes.update(parentGenes(p)[1])
+
+            payloads.append(([(parentGenes(p)[0], p.fitness, p.generation) for p in parents],
+                             [(indices[id(f)], indices[id(s)] if s is not None else -1, seed) for f, s, seed in chunk],
+                             knownNodes))
+
+        offspring = []
+        for payload, result in zip(payloads, self.run(reproduceChunk, payloads)):
+            if result is None:
+                # last resort, reproduce in this process, its clones are already counted
+                children, requests, _ = reproduceChunk(payload, self.BrainClass, self.settings)
+            else:
+                # clones made in the workers only count in their own process
+                children, requests, clones = result
+                Genome.clones += clones
+
+            mapping = {}
+            manager.replay(requests, mapping)
+            for genome, fitness, generation, mutateWeights in children:
+                genome.remap(mapping)
+                child = self.BrainClass.fromCompact(genome, manager, self.settings, generation=generation)
+                child.fitness = fitness
+                offspring.append(child)
+                if mutateWeights is not None:
+                    weightBatch.append((genome, mutateWeights))
+
+        return offspring
@@ -0,0 +1,348 @@
+from utils import sigmoid, sigmoidArray, SIGMOID_MIN
+from math import exp
+import numpy as np
+
+# a batch goes through the dense layers once samples * connections exceeds this
+# many times the number of layers, a dense layer costs about as much as that many
+# connections evaluated in Python
+DENSE_BATCH_COST = 64
+
+def inputList(inputValues, size):
+    """
+    Returns the single sample param inputValues as a list, raises a ValueError unless it
+    holds param size values: a shorter one would leave stale values in the node buffers
+    """
+    if type(inputValues) is not list:
+        inputValues = np.asarray(inputValues, dtype=np.float64).tolist()
+    if len(inputValues) != size:
+        raise ValueError(f"Expected {size} input values, got {len(inputValues)}")
+    return inputValues
+
+class Phenotype:
+    """
+    Compiled version of a genome's network
+
+    Nodes are ordered by (layer, id), which is a topological order. Every computed node
+    gets one step of a flat plan: its position and the (position, weight) pairs of its
+    incoming connections. A single sample is run through the plan in plain Python: NEAT
+    layers hold few nodes, per-layer NumPy calls cost more than they save.
+
+    Large batches use one matrix product per layer instead, see denseLayers().
+
+    Recurrent connections read the values of the previous step, they have their own
+    plan only used by NetworkState. activate() starts from a zero state, recurrent
+    connections have no effect on it.
+
+    A phenotype is only valid for the topology and weights it was compiled from,
+    the owner genome is responsible for dropping it when it mutates.
+    """
+    def __init__(self, nodes, connections, inputs, outputs):
+        """
+        nodes: (layer, id) of every node
+
+        connections: (inNode, outNode, weight, enabled, recurrent) of every connection, nodes are given by id
+
+        inputs: number of input nodes (bias included), ids 0 to inputs - 1
+
+        outputs: number of output nodes, ids inputs to inputs + outputs - 1
+        """
+        position = self.setNodes(nodes, inputs, outputs)
+
+        incoming = [[] for _ in range(self.size)]
+        recurrentIncoming = {}
+        for i, o, w, e, r in connections:
+            target = position[o]
+            # input nodes are set directly and never computed
+            if e and target >= inputs:
+                if r:
+                    recurrentIncoming.setdefault(target, []).append((position[i], w))
+                else:
+                    incoming[target].append((position[i], w))
+
+        self.setSteps(incoming, recurrentIncoming)
+
+    @classmethod
+    def fromGenome(cls, genome):
+        return cls(((n.layer, n.id) for n in genome.nodes.values()),
+                   ((c.inNode.id, c.outNode.id, c.weight, c.enabled, c.recurrent) for c in genome.connections.values()),
+                   genome.settings.inputs + genome.settings.bias, genome.settings.outputs)
+
+    def setNodes(self, nodes, inputs, outputs):
+        """
+        Orders param nodes, returns the position of every node id
+        """
+        order = sorted(nodes)
+        self.nodeLayers = [layer for layer, _ in order]
+        self.nodeIds = [i for _, i in order]
+        position = {i: k for k, i in enumerate(self.nodeIds)}
+
+        self.size = len(self.nodeIds)
+        self.inputs = inputs
+        self.outputPositions = [position[i] for i in range(inputs, inputs + outputs)]
+        return position
+
+    def setSteps(self, incoming, recurrentIncoming):
+        """
+        Builds the plans from the (source, weight) pairs of every node, by position
+        """
+        # (position, [(source, weight), ...]) of every computed node, in order
+        self.steps = list(zip(range(self.inputs, self.size), incoming[self.inputs:]))
+        self.recurrentSteps = sorted(recurrentIncoming.items())
+        self.connections = sum(map(len, incoming))
+
+        # value buffer reused by every single sample pass
+        self.values = [0.0] * self.size
+        self.layers = None
+
+    def denseLayers(self):
+        """
+        Returns the (start, end, sources, matrix) entry of every computed layer: the nodes at
+        positions start to end - 1 get the values at positions sources times matrix
+
+        built on first use, only batches big enough to amortize it need them
+        """
+        if self.layers is None:
+            self.layers = []
+            start = self.inputs
+            while start < self.size:
+                end = start
+                while end < self.size and self.nodeLayers[end] == self.nodeLayers[start]:
+                    end += 1
+                steps = self.steps[start - self.inputs:end - self.inputs]
+                sources = sorted({i for _, pairs in steps for i, _ in pairs})
+                rows = {i: k for k, i in enumerate(sources)}
+                matrix = np.zeros((len(sources), end - start))
+                for t, pairs in steps:
+                    for i, w in pairs:
+                        matrix[rows[i], t - start] += w
+                self.layers.append((start, end, np.array(sources, dtype=np.int64), matrix))
+                start = end
+        return self.layers
+
+    def activate(self, inputValues):
+        """
+        Forward pass
+
+        inputValues: values of the input nodes (bias included), either a single sample
+        (sequence of length inputs) or a batch of samples (ndarray of shape [N, inputs])
+
+        returns the values of the output nodes, a list for a single sample
+        or an ndarray of shape [N, outputs] for a batch
+        """
+        if type(inputValues) is not list and np.ndim(inputValues) == 2:
+            depth = len(set(self.nodeLayers[self.inputs:]))
+            if len(inputValues) * self.connections < DENSE_BATCH_COST * depth:
+                return np.array([self.run(sample) for sample in inputValues.tolist()]).reshape(len(inputValues), -1)
+            return self.activateDense(inputValues)
+        return self.run(inputValues)
+
+    def run(self, inputValues):
+        """
+        Forward pass of a single sample through the flat plan, returns a list
+        """
+        inputValues = inputList(inputValues, self.inputs)
+        values = self.values
+        k = 0
+        for x in inputValues:
+            v = -4.9 * x
+            values[k] = 1 / (1 + exp(v)) if v < 500 else SIGMOID_MIN
+            k += 1
+        for t, pairs in self.steps:
+            total = 0.0
+            for i, w in pairs:
+                total += values[i] * w
+            v = -4.9 * total
+            values[t] = 1 / (1 + exp(v)) if v < 500 else SIGMOID_MIN
+        return [values[k] for k in self.outputPositions]
+
+    def activateDense(self, inputValues):
+        inputValues = np.asarray(inputValues, dtype=np.float64)
+        values = np.zeros((len(inputValues), self.size))
+        values[:, :self.inputs] = sigmoidArray(inputValues)
+
+        for start, end, sources, matrix in self.denseLayers():
+            values[:, start:end] = sigmoidArray(values[:, sources] @ matrix)
+
+        return values[:, self.outputPositions]
+
+class NetworkState:
+    """
+    Runs a Phenotype one step at a time, e.g. once per frame of a game
+
+    Node values are kept between steps, recurrent connections feed the values of the
+    previous step. Like Phenotype.run(), a step goes through the flat plan in plain
+    Python, every buffer is allocated here and reused.
+    """
+    def __init__(self, phenotype: Phenotype, bias=0):
+        """
+        bias: number of bias nodes, the last input nodes of phenotype, they always receive 1
+        """
+        self.phenotype = phenotype
+        self.inputCount = phenotype.inputs - bias
+        self.values = [0.0] * phenotype.size
+        self.outputs = [0.0] * len(phenotype.outputPositions)
+        # sum of the recurrent connections of every node, by position
+        self.recurrentInput = [0.0] * phenotype.size
+
+        self.reset()
+
+    def reset(self):
+        """
+        Sets every node back to 0, to call when a new episode starts
+        """
+        values = self.values
+        for k in range(len(values)):
+            values[k] = 0.0
+        for k in range(self.inputCount, self.phenotype.inputs):
+            values[k] = sigmoid(1)
+
+    def step(self, inputValues):
+        """
+        Computes one step
+
+        inputValues: values of the input nodes (bias excluded), a list is the fastest
+
+        returns the values of the output nodes as a list, overwritten by the next step
+        """
+        inputValues = inputList(inputValues, self.inputCount)
+        phenotype = self.phenotype
+        values = self.values
+        recurrentInput = self.recurrentInput
+
+        # recurrent inputs are computed before the values of the previous step are replaced
+        for t, pairs in phenotype.recurrentSteps:
+            total = 0.0
+            for i, w in pairs:
+                total += values[i] * w
+            recurrentInput[t] = total
+
+        k = 0
+        for x in inputValues:
+            v = -4.9 * x
+            values[k] = 1 / (1 + exp(v)) if v < 500 else SIGMOID_MIN
+            k += 1
+        for t, pairs in phenotype.steps:
+            total = recurrentInput[t]
+            for i, w in pairs:
+                total += values[i] * w
+            v = -4.9 * total
+            values[t] = 1 / (1 + exp(v)) if v < 500 else SIGMOID_MIN
+
+        outputs = self.outputs
+        k = 0
+        for t in phenotype.outputPositions:
+            outputs[k] = values[t]
+            k += 1
+        return outputs
+
+class PopulationPhenotype:
+    """
+    Several networks packed into a single block-sparse network
+
+    The nodes of every network are laid side by side, ordered by network, layer and id.
+    The nodes of layer k of every network are then evaluated together in one stage.
+    Since a layer only reads from the layers before it, all of its inputs are ready by
+    the time its stage runs.
+
+    It is built straight from the genes of the networks, no Phenotype is compiled.
+    Like Phenotype.activate(), recurrent connections have no effect.
+    """
+    def __init__(self, count, inputs, outputs, nodes, connections):
+        """
+        count: number of networks
+
+        inputs: number of input nodes (bias included) of every network, ids 0 to inputs - 1
+
+        outputs: number of output nodes of every network, ids inputs to inputs + outputs - 1
+
+        nodes: (owners, ids, layers) arrays of every node, owners being the index of its network
+
+        connections: (owners, inNodes, outNodes, weights) arrays of the enabled forward
+        connections, nodes are given by id
+        """
+        self.count = count
+        self.inputs = inputs
+        self.outputs = outputs
+
+        nodeOwners, nodeIds, nodeLayers = (np.asarray(a, dtype=np.int64) for a in nodes)
+        owners, inNodes, outNodes = (np.asarray(a, dtype=np.int64) for a in connections[:3])
+        weights = np.asarray(connections[3], dtype=np.float64)
+
+        order = np.lexsort((nodeIds, nodeLayers, nodeOwners))
+        nodeLayers = nodeLayers[order]
+        self.size = len(order)
+
+        # a node is found by its (owner, id) key
+        stride = int(nodeIds.max()) + 1 if self.size > 0 else 1
+        keys = nodeOwners[order] * stride + nodeIds[order]
+        byKey = np.argsort(keys)
+        sortedKeys = keys[byKey]
+        def locate(owners, ids):
+            return byKey[np.searchsorted(sortedKeys, owners * stride + ids)]
+
+        networks = np.arange(count)
+        self.inputPositions = locate(np.repeat(networks, inputs), np.tile(np.arange(inputs), count))
+        self.outputPositions = locate(np.repeat(networks, outputs), np.tile(np.arange(inputs, inputs + outputs), count))
+
+        sources = locate(owners, inNodes)
+        targets = locate(owners, outNodes)
+        targetLayers = nodeLayers[targets]
+        byLayer = np.argsort(targetLayers, kind="stable")
+        layers = np.arange(1, int(nodeLayers.max(initial=0)) + 1)
+        starts = np.searchsorted(targetLayers[byLayer], layers)
+        ends = np.searchsorted(targetLayers[byLayer], layers, side="right")
+
+        # every (targets, sources, destinations, weights) entry is one stage,
+        # destinations index the connections' target nodes within targets
+        self.stages = []
+        for layer, start, end in zip(layers.tolist(), starts.tolist(), ends.tolist()):
+            stageTargets = np.flatnonzero(nodeLayers == layer)
+            if len(stageTargets) == 0:
+                continue
+            c = byLayer[start:end]
+            self.stages.append((stageTargets, sources[c], np.searchsorted(stageTargets, targets[c]), weights[c]))
+
+    @classmethod
+    def fromGenomes(cls, genomes):
+        """
+        Packs the networks of param genomes, sharing the same settings
+        """
+        settings = genomes[0].settings
+        nodes = [list(g.nodes.values()) for g in genomes]
+        connections = [[c for c in g.connections.values() if c.enabled and not c.recurrent] for g in genomes]
+
+        networks = np.arange(len(genomes))
+        allNodes = [n for ns in nodes for n in ns]
+        allConnections = [c for cs in connections for c in cs]
+        return cls(len(genomes), settings.inputs + settings.bias, settings.outputs,
+                   (np.repeat(networks, [len(ns) for ns in nodes]),
+                    [n.id for n in allNodes],
+                    [n.layer for n in allNodes]),
+                   (np.repeat(networks, [len(cs) for cs in connections]),
+                    [c.inNode.id for c in allConnections],
+                    [c.outNode.id for c in allConnections],
+                    [c.weight for c in allConnections]))
+
+    def activate(self, inputValues):
+        """
+        Forward pass of every network on the same batch of samples
+
+        inputValues: ndarray of shape [N, inputs] (bias included)
+
+        returns an ndarray of shape [networks, N, outputs]
+        """
+        inputValues = np.asarray(inputValues, dtype=np.float64)
+        samples = len(inputValues)
+        values = np.zeros((samples, self.size))
+        values[:, self.inputPositions] = np.tile(sigmoidArray(inputValues), self.count)
+
+        sampleOffsets = np.arange(samples)[:, None]
+        for targets, sources, destinations, weights in self.stages:
+            # weighted sums of all the stage's nodes for every sample in one bincount
+            contributions = values[:, sources] * weights
+            bins = sampleOffsets * len(targets) + destinations
+            sums = np.bincount(bins.ravel(), weights=contributions.ravel(), minlength=samples * len(targets))
+            values[:, targets] = sigmoidArray(sums.reshape(samples, len(targets)))
+
+        outputs = values[:, self.outputPositions].reshape(samples, self.count, self.outputs)
+        return outputs.transpose(1, 0, 2)
@@ -1,31 +1,75 @@
 from species import Species
 from settings import GenomeSettings, PopulationSettings
 from innovationManager import InnovationManager
+from genome import Genome
+from parallel import WorkerPool
+from distance import PackedGenes
+from instrumentation import GenerationStats
+from utils import spawnRandom
+from fitnessCache import FitnessCache
+from hallOfFame import HallOfFame
+import numpy as np
+import asyncio
 import random
 
 # TODO Deal with staleness problem
 # TODO Test with real optimization problem
 
 class Population:
-    def __init__(self, settings: PopulationSettings, BrainClass: type):
+    def __init__(self, settings: PopulationSettings, BrainClass: type,
+                 innovationManager: InnovationManager = None, brains: list = None):
+        """
+        innovationManager: manager shared by the brains, a new one is created if None
+
+        brains: initial brains of the population, created randomly if None
+        """
         self.settings = settings
         self.BrainClass = BrainClass
 
         self.species = []
         self.brains = []
-        self.championHistory = []
+        # last global champions, in compact form
+        self.hallOfFame = HallOfFame(self.settings.hallOfFameSize)
 
         self.generation = 0
 
-        self.innovationManager = InnovationManager(self.settings.genome)
+        # every random choice of the evolution derives from this sequence, runs with the
+        # same seed are identical. Each offspring gets its own random.Random stream so
+        # that its creation doesn't depend on the order offspring are created in
+        self.seedSequence = np.random.SeedSequence(self.settings.seed)
+        self.rng = spawnRandom(self.seedSequence, 1)[0]
+
+        if innovationManager is None:
+            innovationManager = InnovationManager(self.settings.genome,
+                                                  self.settings.innovationResetInterval,
+                                                  self.settings.innovationHistoryLimit)
+        self.innovationManager = innovationManager
 
-        for _ in range(self.settings.size):
-            b = self.BrainClass.create(self.innovationManager, self.settings.genome)
-            b.mutate()
-            self.brains.append(b)
+        # workers only know the node splits recorded before a reproduction starts, a limited
+        # history may forget some of them halfway through it and the serial results would differ
+        if self.settings.reproduction.mode == "parallel" and self.innovationManager.historyLimit is not None:
+            raise ValueError("innovationHistoryLimit is not supported by the parallel reproduction mode")
+
+        if brains is not None:
+            self.brains = brains
+        else:
+            for rng in spawnRandom(self.seedSequence, self.settings.size):
+                b = self.BrainClass.create(self.innovationManager, self.settings.genome)
+                b.mutate(rng)
+                self.brains.append(b)
 
         self.globalChampion = self.brains[0]
 
+        # worker pool of the "parallel" evaluation and reproduction modes, started on first use
+        self.workerPool: WorkerPool = None
+
+        # fitness values by genome structure, see EvaluationSettings.cacheSize
+        self.fitnessCache = FitnessCache(self.settings.evaluation.cacheSize) if self.settings.evaluation.cacheSize > 0 else None
+
+        # callables receiving the GenerationStats of every generation
+        self.observers = []
+        self.lastStats: GenerationStats = None
+
 
     def __str__(self):
         value = "POPULATION:\n\n"
@@ -36,81 +80,316 @@ class Population:
         return value
 
     def evolve(self):
+        """
+        Computes one generation, returns True if a new global champion was found
+        """
+        stats = self.startGeneration()
+
+        # evaluate the fitness of every brain of this population
+        with stats.phase("evaluate"):
+            self.evaluateFitness()
+
+        return self.endGeneration(stats)
+
+    async def evolveAsync(self):
+        """
+        Same as evolve() but brains are evaluated concurrently with Brain.fitnessEvaluationAsync,
+        at most EvaluationSettings.concurrency at a time
+        """
+        stats = self.startGeneration()
+
+        with stats.phase("evaluate"):
+            await self.evaluateFitnessAsync()
+
+        return self.endGeneration(stats)
+
+    def startGeneration(self):
+        """
+        First phase of a generation, speciates the brains before their evaluation
+
+        returns the GenerationStats of the generation
+        """
         print(f"Generation: {self.generation}")
 
-        newChampion = False
+        stats = GenerationStats(self.generation)
+        # counters at the start of the generation, turned into differences by endGeneration()
+        stats.innovations = self.innovationManager.connectionInnovationCounter + self.innovationManager.nodeInnovationCounter
+        stats.clones = Genome.clones
+        stats.cacheHits = self.fitnessCache.hits if self.fitnessCache is not None else 0
 
-        self.speciate()
+        with stats.phase("speciate"):
+            self.speciate()
 
-        # evaluate the fitness of every brain of this population
-        for b in self.brains: 
-            b.evaluateFitness()
+        return stats
+
+    def endGeneration(self, stats: GenerationStats):
+        """
+        Last phase of a generation, once every brain has been evaluated: updates
+        the species and the champions and replaces the brains by their offspring
+
+        returns True if a new global champion was found
+        """
+        newChampion = False
+        if self.fitnessCache is not None:
+            stats.cacheHits = self.fitnessCache.hits - stats.cacheHits
 
         # cull species and compute adjusted average fitness 
         # to prepare the computation of the next generation
-        for s in self.species:
-            s.sort()
-            s.cull(self.settings.cullRate)
-            s.updateAvgAdjustedFitness()
+        with stats.phase("cull"):
+            for s in self.species:
+                s.sort()
+                s.cull(self.settings.cullRate)
+                s.updateAvgAdjustedFitness()
+                s.prepareSelection(self.settings.selectionMethod, self.settings.tournamentSize)
 
-        # sort species by their respective champion
-        self.species.sort(key=lambda s: s.fitness, reverse=True)
+            # sort species by their respective champion
+            self.species.sort(key=lambda s: s.fitness, reverse=True)
+
+            # species which have been stale for too long are removed, except the best one
+            self.species = self.species[:1] + [s for s in self.species[1:] if s.staleness < self.settings.maxStaleness]
 
         # update best player if needed
-        if self.globalChampion.fitness < self.species[0].population[0].fitness:
-            newChampion = True
-            self.globalChampion = self.species[0].population[0]
-            self.championHistory.append(self.BrainClass.clone(self.globalChampion))
-            print(f"New champion brain - Generation {self.generation} - Fitness {self.globalChampion.fitness}")
+        with stats.phase("champion"):
+            if self.globalChampion.fitness < self.species[0].population[0].fitness:
+                newChampion = True
+                self.globalChampion = self.species[0].population[0]
+                self.hallOfFame.add(self.globalChampion)
+                print(f"New champion brain - Generation {self.generation} - Fitness {self.globalChampion.fitness}")
 
-        # TODO remove bad species and species which have been stale for too long
-        for s in self.species:
-            # stale species shouldn't be allowed to produce a lot of offspring
-            if s.staleness >= self.settings.maxStaleness:
-                s.avgAdjustedFitness *= 0.05
+        stats.species = len(self.species)
+        stats.brains = len(self.brains)
+        stats.meanGenomeSize = sum(b.genomeSize() for b in self.brains) / len(self.brains)
+        stats.bestFitness = max(b.fitness for b in self.brains)
+        stats.meanFitness = sum(b.fitness for b in self.brains) / len(self.brains)
+        stats.newChampion = newChampion
+        stats.champion = self.globalChampion
 
         self.generation += 1
+        self.innovationManager.newGeneration()
 
-        nextGeneration = []
-        avgAdjustedFitnessSum = self.getAvgAdjustedFitnessSum()
-        for s in self.species:
-            best = self.BrainClass.clone(s.champion)
-            best.generation = self.generation
-            nextGeneration.append(best)
+        with stats.phase("offspring"):
+            nextGeneration = []
+            avgAdjustedFitnessSum = self.getAvgAdjustedFitnessSum()
+            nOffspring = [max(0, int(self.settings.size * (s.avgAdjustedFitness / avgAdjustedFitnessSum) - 1)) for s in self.species]
+            nFill = max(0, self.settings.size - len(self.species) - sum(nOffspring))
+            streams = iter(spawnRandom(self.seedSequence, sum(nOffspring) + nFill))
+
+            # parents are selected here, offspring are built afterwards
+            # slots: position of every offspring in nextGeneration
+            slots, tasks = [], []
+            def plan(s):
+                slots.append(len(nextGeneration))
+                tasks.append(self.planOffspring(s, next(streams)))
+                nextGeneration.append(None)
+
+            for s, n in zip(self.species, nOffspring):
+                # the champion is cloned as it starts a new life in the next generation
+                best = self.BrainClass.clone(s.champion)
+                best.generation = self.generation
+                nextGeneration.append(best)
+
+                for _ in range(n):
+                    plan(s)
 
-            nOffspring = int(self.settings.size * (s.avgAdjustedFitness / avgAdjustedFitnessSum) - 1)
-            for _ in range(nOffspring):
-                nextGeneration.append(self.generateOffspring(s))
+            for _ in range(nFill):
+                plan(self.species[0])
 
-        while len(nextGeneration) < self.settings.size:
-            nextGeneration.append(self.generateOffspring(self.species[0]))
+            for i, child in zip(slots, self.reproduce(tasks)):
+                nextGeneration[i] = child
 
-        self.brains = nextGeneration
+            self.brains = nextGeneration
+
+        stats.innovations = self.innovationManager.connectionInnovationCounter + self.innovationManager.nodeInnovationCounter - stats.innovations
+        stats.clones = Genome.clones - stats.clones
+        self.lastStats = stats
+        for observer in self.observers:
+            observer(stats)
 
         return newChampion
 
-    def generateOffspring(self, s: Species):
-        offspring = None
-        if random.random() < self.settings.crossoverRate:
+    def addObserver(self, observer):
+        """
+        Registers param observer, a callable receiving the GenerationStats
+        of every generation at the end of evolve()
+        """
+        self.observers.append(observer)
+
+    def removeObserver(self, observer):
+        self.observers.remove(observer)
+
+    def evaluateFitness(self):
+        keys, unknown = self.lookupFitness()
+        self.evaluateBrains(list(unknown.values()))
+        self.storeFitness(keys, unknown)
+
+    async def evaluateFitnessAsync(self):
+        keys, unknown = self.lookupFitness()
+        await self.evaluateBrainsAsync(list(unknown.values()))
+        self.storeFitness(keys, unknown)
+
+    def lookupFitness(self):
+        """
+        Sets the fitness of the brains found in the fitness cache
+
+        returns (keys, unknown): keys holds the cache key of every brain, None if the cache
+        is not used, unknown the brain to evaluate for every unknown key
+        """
+        settings = self.settings.evaluation
+        if self.fitnessCache is None or not settings.deterministicFitness:
+            return None, dict(enumerate(self.brains))
+
+        # only the first brain of every unknown structure is evaluated
+        keys = [b.genes().structuralHash(settings.cacheQuantization) for b in self.brains]
+        unknown = {}
+        for b, key in zip(self.brains, keys):
+            if key not in unknown:
+                fitness = self.fitnessCache.get(key)
+                if fitness is None:
+                    unknown[key] = b
+                else:
+                    b.fitness = fitness
+        return keys, unknown
+
+    def storeFitness(self, keys, unknown):
+        """
+        Caches the fitness of the brains evaluated after lookupFitness()
+        and copies it to the brains sharing their structure
+        """
+        if keys is None:
+            return
+
+        for key, b in unknown.items():
+            self.fitnessCache.put(key, b.fitness)
+
+        for b, key in zip(self.brains, keys):
+            if key in unknown:
+                b.fitness = unknown[key].fitness
+
+    def evaluateBrains(self, brains):
+        if len(brains) == 0:
+            return
+
+        if self.settings.evaluation.mode == "vectorized":
+            inputValues = self.BrainClass.batchInputValues
+            outputValues = Genome.generateOutputValuesPopulation([b.genome for b in brains], inputValues)
+            for b, o in zip(brains, outputValues):
+                b.outputValues = o
+                b.fitness = b.fitnessEvaluationBatch(o)
+        elif self.settings.evaluation.mode == "parallel":
+            self.getWorkerPool().evaluate(brains, self.settings.evaluation.chunkSize)
+        else:
+            for b in brains:
+                b.evaluateFitness()
+
+    async def evaluateBrainsAsync(self, brains):
+        semaphore = asyncio.Semaphore(self.settings.evaluation.concurrency)
+
+        async def evaluate(brain):
+            async with semaphore:
+                await brain.evaluateFitnessAsync()
+
+        await asyncio.gather(*(evaluate(b) for b in brains))
+
+    def invalidateFitnessCache(self):
+        """
+        Forgets every cached fitness value, to call when the fitness function changes
+        """
+        if self.fitnessCache is not None:
+            self.fitnessCache.clear()
+
+    def getWorkerPool(self):
+        if self.workerPool is None:
+            self.workerPool = WorkerPool(self.BrainClass,
+                                         self.settings.genome,
+                                         self.settings.evaluation.workers,
+                                         self.settings.evaluation.maxRetries)
+        return self.workerPool
+
+    def close(self):
+        """
+        Stops the worker processes of the "parallel" evaluation and reproduction modes,
+        they are started again by the next generation that needs them
+        """
+        if self.workerPool is not None:
+            self.workerPool.close()
+            self.workerPool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def planOffspring(self, s: Species, rng: random.Random):
+        """
+        Selects the parents of an offspring of param s, every random choice is drawn from param rng
+
+        returns a (first, second, seed) task for Brain.offspring, second is None for a mutated clone
+        and seed seeds the random.Random used to build the offspring
+        """
+        if rng.random() < self.settings.crossoverRate:
             other = s
-            if random.random() < self.settings.interSpeciesCrossoverRate:
-                other = random.choice(self.species)
-            offspring = s.mate(other)
+            if rng.random() < self.settings.interSpeciesCrossoverRate:
+                other = rng.choice(self.species)
+            parent1 = s.selectBrain(rng)
+            parent2 = other.selectBrain(rng)
+            first, second = (parent1, parent2) if parent1.fitness > parent2.fitness else (parent2, parent1)
         else:
-            offspring = s.generateChild()
+            first, second = s.selectBrain(rng), None
+        return first, second, rng.getrandbits(128)
+
+    def reproduce(self, tasks):
+        """
+        Builds the offspring of param tasks, see planOffspring()
+
+        The weights of the mutated clones are mutated afterwards, all at once
+        """
+        weightBatch = []
+        if self.settings.reproduction.mode == "parallel":
+            offspring = self.getWorkerPool().reproduce(tasks, self.innovationManager, weightBatch, self.settings.reproduction.chunkSize)
+        else:
+            offspring = [self.BrainClass.offspring(first, second, random.Random(seed), weightBatch) for first, second, seed in tasks]
+
+        # the batch is in the order of tasks in both modes, they get the same weights
+        Genome.mutateWeights(weightBatch, self.settings.genome.mutation,
+                             np.random.default_rng(self.seedSequence.spawn(1)[0]))
         return offspring
 
+    def generateOffspring(self, s: Species, rng: random.Random):
+        """
+        Generates an offspring of param s, every random choice is drawn from param rng
+        """
+        return self.reproduce([self.planOffspring(s, rng)])[0]
+
     def speciate(self):
-        # assign a species to every brain 
-        for b in self.brains:
-            lonely = True
-            for s in self.species:
-                if s.shouldContain(b, self.settings.speciesDistanceThreshold):
-                    s.add(b)
-                    lonely = False
-                    break
-            if lonely:
-                self.species.append(Species(b))
+        # assign a species to every brain, the brain goes to the first species it is close enough to
+        genes = PackedGenes([b.genes() for b in self.brains])
+        unassigned = np.ones(len(self.brains), dtype=bool)
+
+        for s in self.species:
+            s.reset(self.rng)
+            self.assignToSpecies(s, genes, unassigned)
+
+        # species which did not get any brain are extinct
+        self.species = [s for s in self.species if len(s.population) > 0]
+
+        # remaining brains found their own species, in order
+        while unassigned.any():
+            i = int(np.argmax(unassigned))
+            unassigned[i] = False
+            s = Species(self.brains[i])
+            self.species.append(s)
+            self.assignToSpecies(s, genes, unassigned)
+
+    def assignToSpecies(self, s: Species, genes: PackedGenes, unassigned):
+        """
+        Adds to param s every unassigned brain close enough to its representative
+        """
+        distances = genes.distances(s.representative.genes(), self.settings.genome.distance)
+        members = unassigned & (distances < self.settings.speciesDistanceThreshold)
+        for i in np.flatnonzero(members):
+            s.add(self.brains[i])
+        unassigned &= ~members
     
     def getAvgAdjustedFitnessSum(self):
         avgAdjustedFitnessSum = 0
@@ -0,0 +1,73 @@
+from itertools import accumulate
+import bisect
+
+class RouletteSelector:
+    """
+    Fitness-proportional selection with a binary search in the cumulative fitness, O(log n)
+    """
+    def __init__(self, brains):
+        self.brains = brains
+        # negative fitness values can't be selected
+        self.cumulativeFitness = list(accumulate(max(b.fitness, 0.0) for b in brains))
+
+    def select(self, rng):
+        total = self.cumulativeFitness[-1]
+        if total <= 0:
+            return rng.choice(self.brains)
+
+        i = bisect.bisect_right(self.cumulativeFitness, rng.random() * total)
+        # rounding can put r right on the total
+        return self.brains[min(i, len(self.brains) - 1)]
+
+class AliasSelector:
+    """
+    Fitness-proportional selection with Walker's alias method, O(1)
+    """
+    def __init__(self, brains):
+        self.brains = brains
+        n = len(brains)
+        fitness = [max(b.fitness, 0.0) for b in brains]
+        total = sum(fitness)
+        if total <= 0:
+            fitness, total = [1.0] * n, float(n)
+
+        # Vose's construction: every column i keeps i with probability probabilities[i],
+        # and falls back to aliases[i] otherwise
+        scaled = [f * n / total for f in fitness]
+        self.probabilities = [1.0] * n
+        self.aliases = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.probabilities[s] = scaled[s]
+            self.aliases[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+
+    def select(self, rng):
+        i = rng.randrange(len(self.brains))
+        return self.brains[i] if rng.random() < self.probabilities[i] else self.brains[self.aliases[i]]
+
+class TournamentSelector:
+    """
+    Returns the fittest of tournamentSize brains drawn uniformly, O(tournamentSize)
+    """
+    def __init__(self, brains, tournamentSize=3):
+        self.brains = brains
+        self.tournamentSize = tournamentSize
+
+    def select(self, rng):
+        return max(rng.choices(self.brains, k=self.tournamentSize), key=lambda b: b.fitness)
+
+def createSelector(brains, method="roulette", tournamentSize=3):
+    """
+    method: "roulette", "alias" or "tournament"
+    """
+    if method == "roulette":
+        return RouletteSelector(brains)
+    if method == "alias":
+        return AliasSelector(brains)
+    if method == "tournament":
+        return TournamentSelector(brains, tournamentSize)
+    raise ValueError(f"Unknown selection method: {method}")
@@ -10,7 +10,8 @@ class MutationSettings:
                  addConnectionMutationRate: float = 0.1,
                  addNodeMutationRate: float = 0.01,
                  togglesEnableMutationRate: float = 0.05,
-                 reEnableMutationRate: float = 0.2):
+                 reEnableMutationRate: float = 0.2,
+                 addRecurrentConnectionMutationRate: float = 0.0):
         self.weightMutationRate = weightMutationRate
         self.weightMutationStep = weightMutationStep
         self.weightMutationStepRate = weightMutationStepRate
@@ -19,6 +20,8 @@ class MutationSettings:
         self.addNodeMutationRate = addNodeMutationRate
         self.togglesEnableMutationRate = togglesEnableMutationRate
         self.reEnableMutationRate = reEnableMutationRate
+        # recurrent connections only matter to brains evaluated with the stateful step mode
+        self.addRecurrentConnectionMutationRate = addRecurrentConnectionMutationRate
 
 @dataclass
 class DistanceSettings:
@@ -42,6 +45,67 @@ class GenomeSettings:
         self.mutation = mutationSettings
         self.distance = distanceSettings
 
+@dataclass
+class EvaluationSettings:
+    def __init__(self,
+                 mode: str = "serial",
+                 workers: int = None,
+                 chunkSize: int = None,
+                 maxRetries: int = 1,
+                 cacheSize: int = 0,
+                 cacheQuantization: float = 1e-9,
+                 deterministicFitness: bool = True,
+                 concurrency: int = 16):
+        """
+        mode: "serial" calls fitnessEvaluation() on each brain,
+              "vectorized" evaluates BrainClass.batchInputValues on the whole population
+              in one pass and calls fitnessEvaluationBatch() on each brain,
+              "parallel" calls fitnessEvaluation() in a pool of worker processes
+
+        workers: number of worker processes, defaults to the number of CPUs,
+        the pool is shared with the "parallel" reproduction mode
+
+        chunkSize: number of brains sent to a worker at once, defaults to an even split
+
+        maxRetries: number of times failed chunks are sent again to the pool before
+        being evaluated in the main process
+
+        cacheSize: if > 0, fitness values are cached by genome structure (enabled innovations
+        and weights) and brains identical to an already evaluated one are not evaluated again
+
+        cacheQuantization: weights are rounded to this step to compute the cache keys
+
+        deterministicFitness: set to False if the same genome can get different fitness values,
+        the cache is then never used
+
+        concurrency: maximum number of brains evaluated at the same time by
+        Population.evolveAsync, which ignores mode
+        """
+        self.mode = mode
+        self.workers = workers
+        self.chunkSize = chunkSize
+        self.maxRetries = maxRetries
+        self.cacheSize = cacheSize
+        self.cacheQuantization = cacheQuantization
+        self.deterministicFitness = deterministicFitness
+        self.concurrency = concurrency
+
+@dataclass
+class ReproductionSettings:
+    def __init__(self,
+                 mode: str = "serial",
+                 chunkSize: int = None):
+        """
+        mode: "serial" builds the offspring in the main process,
+              "parallel" builds them in the worker pool configured by EvaluationSettings
+              (workers, maxRetries), the result is identical to the serial mode.
+              It can't be used with PopulationSettings.innovationHistoryLimit
+
+        chunkSize: number of offspring built by a worker at once, defaults to an even split
+        """
+        self.mode = mode
+        self.chunkSize = chunkSize
+
 @dataclass
 class PopulationSettings:
     def __init__(self,
@@ -51,11 +115,27 @@ class PopulationSettings:
                  cullRate: float = 0.5,
                  maxStaleness: int = 100,
                  crossoverRate: float = 0.75,
-                 interSpeciesCrossoverRate: float = 0.0001):
+                 interSpeciesCrossoverRate: float = 0.0001,
+                 selectionMethod: str = "roulette",
+                 tournamentSize: int = 3,
+                 innovationResetInterval: int = 0,
+                 innovationHistoryLimit: int = None,
+                 seed: int = None,
+                 hallOfFameSize: int = 100,
+                 evaluationSettings: EvaluationSettings = EvaluationSettings(),
+                 reproductionSettings: ReproductionSettings = ReproductionSettings()):
         self.size = size
         self.genome = genomeSettings
         self.speciesDistanceThreshold = speciesDistanceThreshold
         self.cullRate = cullRate
         self.maxStaleness = maxStaleness
         self.crossoverRate = crossoverRate
-        self.interSpeciesCrossoverRate = interSpeciesCrossoverRate
\ No newline at end of file
+        self.interSpeciesCrossoverRate = interSpeciesCrossoverRate
+        self.selectionMethod = selectionMethod # "roulette", "alias" or "tournament"
+        self.tournamentSize = tournamentSize
+        self.innovationResetInterval = innovationResetInterval
+        self.innovationHistoryLimit = innovationHistoryLimit
+        self.seed = seed
+        self.hallOfFameSize = hallOfFameSize # number of past global champions kept, None for all
+        self.evaluation = evaluationSettings
+        self.reproduction = reproductionSettings
@@ -1,18 +1,26 @@
 from brain import Brain
+from selection import createSelector
 import random
 
 class Species:
     def __init__(self, base: Brain):
         self.BrainClass = type(base)
 
-        self.champion: Brain = self.BrainClass.clone(base)
+        # best brain the species ever had, brains are not modified once evaluated so it is not copied
+        self.champion: Brain = base
         self.fitness = self.champion.fitness
         self.avgAdjustedFitness = 0
         
         self.population = [base]
 
+        # brain of the previous generation new brains are compared to, see reset()
+        self.representative: Brain = base
+
         self.staleness = 0
 
+        # selection structure, built from the population by prepareSelection()
+        self.selector = None
+
     def __str__(self):
         value = f"Brains: {len(self.population)} Fitness: {self.fitness} Staleness: {self.staleness}\n"
         # value += f"\n"
@@ -21,10 +29,21 @@ class Species:
         return value
 
     def shouldContain(self, brain, threshold):
-        return self.champion.distance(brain) < threshold
+        return self.representative.distance(brain) < threshold
+
+    def reset(self, rng=random):
+        """
+        Empties this species before a new generation is speciated,
+        a random member of the previous generation becomes its representative
+        """
+        if len(self.population) > 0:
+            self.representative = rng.choice(self.population)
+        self.population = []
+        self.selector = None
 
     def add(self, brain):
         self.population.append(brain)
+        self.selector = None
 
     def sort(self):
         """
@@ -32,31 +51,32 @@ class Species:
         make sure that this generation's fitness has been computed before!
         """
         self.population.sort(key=lambda b: b.fitness, reverse=True)
+        self.selector = None
 
         if self.population[0].fitness > self.fitness:
-            self.champion = self.BrainClass.clone(self.population[0])
+            self.champion = self.population[0]
             self.fitness = self.champion.fitness
             self.staleness = 0
         else:
             self.staleness += 1 # this species has not improve this generation
 
-    def selectBrain(self):
+    def prepareSelection(self, method="roulette", tournamentSize=3):
+        """
+        Builds the structure used by selectBrain(), once per generation
+
+        call .sort() and .cull() before!
+        """
+        self.selector = createSelector(self.population, method, tournamentSize)
+
+    def selectBrain(self, rng=random):
         """
         Randomly selects a brain from this species w.r.t. its fitness.
 
         call .sort() before!
         """
-        fitnessSum = 0
-        for b in self.population: fitnessSum += b.fitness
-
-        r = random.random() * fitnessSum
-        runningSum = 0
-        for b in self.population:
-            runningSum += b.fitness
-            if r < runningSum: 
-                return b
-        print(f"ERROR IN THE BRAIN SELECTION PROCESS: fitnessSum: {fitnessSum}, r: {r}, runningSum: {runningSum}")
-        print(self)
+        if self.selector is None:
+            self.prepareSelection()
+        return self.selector.select(rng)
 
     def updateAvgAdjustedFitness(self):
         """
@@ -84,23 +104,24 @@ class Species:
         
         for _ in range(int(len(self.population)*cullRate)):
             self.population.pop()
+        self.selector = None
 
-    def generateChild(self):
+    def generateChild(self, rng=random):
         """
         Generates a mutated clone child from this species
         """
-        child = self.BrainClass.clone(self.selectBrain())
-        child.mutate()
+        child = self.BrainClass.clone(self.selectBrain(rng))
+        child.mutate(rng)
         return child
 
-    def mate(self, species):
+    def mate(self, species, rng=random):
         """
         Generates a child by crossover between a child from this species
         a child from param species
         """
-        parent1 = self.selectBrain()
-        parent2 = species.selectBrain()
+        parent1 = self.selectBrain(rng)
+        parent2 = species.selectBrain(rng)
         if parent1.fitness > parent2.fitness:
-            return self.BrainClass.crossover(parent1, parent2)
+            return self.BrainClass.crossover(parent1, parent2, rng)
         else: 
-            return self.BrainClass.crossover(parent2, parent1)
\ No newline at end of file
+            return self.BrainClass.crossover(parent2, parent1, rng)
\ No newline at end of file
@@ -10,7 +10,7 @@ def testTopologies(n, settings):
     times = []
     for idx in range(n):
         t = Timer()
-        manager = InnovationManager(settings.inputs + settings.bias + settings.outputs)
+        manager = InnovationManager(settings)
         a = Genome(manager, settings)
         b = Genome(manager, settings)
         t.record()
@@ -30,21 +30,21 @@ def testTopologies(n, settings):
             print(f"b has an invalid topology when idx = {idx}")
             b.plot(block=True)
             return
-        c = a.crossover(b)
+        c = Genome.crossover(a, b)
         if not c.isTopologyValid():
             print(c)
             print("TEST FAILED")
             print(f"c has an invalid topology when idx = {idx} after a.cross(b)")
             c.plot(block=True)
             return
-        c = b.crossover(a)
+        c = Genome.crossover(b, a)
         if not c.isTopologyValid():
             print(c)
             print("TEST FAILED")
             print(f"c has an invalid topology when idx = {idx} after b.cross(a)")
             c.plot(block=True)           
             return
-        c = b.crossover(a, sameFitness=True)
+        c = Genome.crossover(b, a, sameFitness=True)
         if not c.isTopologyValid():
             print(c)
             print("TEST FAILED")
@@ -0,0 +1,54 @@
+from collections import deque
+from errors import InvalidTopologyError
+
+def assignLayers(nodes, inputIds, outputIds):
+    """
+    Sets the layer of every node to the length of the longest path reaching it and
+    returns the number of layers, in O(nodes + connections)
+
+    Inputs are on layer 0, outputs on the last layer and hidden nodes on layer 1 or
+    above, even when none of their incoming connections were kept. Recurrent
+    connections are ignored
+
+    nodes: dict of Node by id
+
+    inputIds: ids of the input and bias nodes
+
+    outputIds: ids of the output nodes
+    """
+    inDegrees = dict.fromkeys(nodes, 0)
+    for node in nodes.values():
+        for c in node.outputs:
+            if not c.recurrent:
+                inDegrees[c.outNode.id] += 1
+
+    for node in nodes.values():
+        node.layer = 0
+
+    # Kahn's algorithm, a node is visited once all of its sources have been
+    queue = deque(node for node in nodes.values() if inDegrees[node.id] == 0)
+    visited = 0
+    while queue:
+        node = queue.popleft()
+        visited += 1
+        if node.id not in inputIds and node.layer == 0:
+            node.layer = 1
+        for c in node.outputs:
+            if c.recurrent:
+                continue
+            n = c.outNode
+            if n.layer <= node.layer:
+                n.layer = node.layer + 1
+            inDegrees[n.id] -= 1
+            if inDegrees[n.id] == 0:
+                queue.append(n)
+
+    if visited != len(nodes):
+        raise InvalidTopologyError("The connections of the genome contain a cycle")
+
+    outputIds = set(outputIds)
+    maxLayer = max((n.layer for n in nodes.values() if n.id not in outputIds), default=0) + 1
+    for i in outputIds:
+        nodes[i].layer = maxLayer
+
+    return maxLayer + 1
@@ -1,3 +1,20 @@
 import math
+import random
+import numpy as np
 
 sigmoid = lambda x: 1 / (1 + math.exp(-4.9*x))
+
+# value of sigmoidArray for x <= -500/4.9, where the exponent is clipped
+SIGMOID_MIN = 1 / (1 + math.exp(500))
+
+def sigmoidArray(x):
+    # vectorized version of sigmoid, the exponent is clipped to avoid overflow warnings
+    return 1 / (1 + np.exp(np.clip(-4.9*x, -500, 500)))
+
+def spawnRandom(seedSequence: np.random.SeedSequence, n):
+    """
+    Returns n independent random.Random generators derived from param seedSequence
+    """
+    # one child sequence per call, each generator gets 128 bits of its state
+    state = seedSequence.spawn(1)[0].generate_state(4 * n)
+    return [random.Random(int.from_bytes(state[4*i:4*i+4].tobytes(), "little")) for i in range(n)]